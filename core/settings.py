@@ -85,6 +85,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'website.context_processors.cart',
             ],
         },
     },
@@ -108,6 +109,47 @@ DATABASES = {
 }
 
 
+# Cache
+# CACHE picks the cache shared by every gunicorn worker: file (a folder at CACHE_LOCATION), database
+# (a table, create it with createcachetable) or memory (per process).
+# website.caching.TieredCache keeps the most used entries in each process for a few seconds in front of it.
+# Its get_or_set stops other workers recomputing the same key with cache.add, which the file cache does as a
+# check then a write: two workers can still both recompute a key. Use database for an atomic add.
+
+CACHE_LOCATION = os.environ.get("CACHE_LOCATION")
+
+CACHE_BACKENDS = {
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_LOCATION or BASE_DIR / "cache",
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'database': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': CACHE_LOCATION or "website_cache",
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'memory': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+CACHE = os.environ.get("CACHE", "file")
+
+CACHES = {
+    'default': {
+        'BACKEND': 'website.caching.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            # Entries kept in each process, and for how many seconds at most
+            'MAX_ENTRIES': int(os.environ.get("LOCAL_CACHE_MAX_ENTRIES", 1000)),
+            'LOCAL_TIMEOUT': int(os.environ.get("LOCAL_CACHE_TIMEOUT", 5)),
+        },
+    },
+    'shared': CACHE_BACKENDS[CACHE],
+}
+
+# Runs the tests with their own cache, so test data never shows up on the development server
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+
 
 
 # Password validation
@@ -144,10 +186,48 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 
-DEFAULT_FILE_STORAGE = os.environ.get("DEFAULT_FILE_STORAGE", " ")
-AZURE_ACCOUNT_NAME = os.environ.get("AZURE_ACCOUNT_NAME", " ")
-AZURE_ACCOUNT_KEY = os.environ.get("AZURE_ACCOUNT_KEY", " ")
-AZURE_CONTAINER = os.environ.get("AZURE_CONTAINER", " ")
+# Uploaded files
+# FILE_STORAGE picks the backend: azure (Blob Container), local (MEDIA_ROOT) or memory (nothing is kept, for tests).
+# The storage is only built the first time a file is read or written, and then reused by every request.
+
+AZURE_ACCOUNT_NAME = os.environ.get("AZURE_ACCOUNT_NAME")
+AZURE_ACCOUNT_KEY = os.environ.get("AZURE_ACCOUNT_KEY")
+AZURE_CONTAINER = os.environ.get("AZURE_CONTAINER")
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", BASE_DIR / "media")
+MEDIA_URL = 'media/'
+
+FILE_STORAGES = {
+    'azure': {
+        'BACKEND': 'storages.backends.azure_storage.AzureStorage',
+        'OPTIONS': {
+            'account_name': AZURE_ACCOUNT_NAME,
+            'account_key': AZURE_ACCOUNT_KEY,
+            'azure_container': AZURE_CONTAINER,
+        },
+    },
+    'local': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'memory': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+}
+FILE_STORAGE = os.environ.get("FILE_STORAGE", "azure" if AZURE_ACCOUNT_NAME else "local")
+
+STORAGES = {
+    'default': FILE_STORAGES[FILE_STORAGE],
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Resized copies are generated on a background thread, turn off to generate them in the request
+IMAGE_VARIANTS_ASYNC = True
+IMAGE_VARIANTS_QUEUE_SIZE = 100
+
+# Order events
+# Messages are saved with the order and sent by drain_outbox, use MemoryBackend or FileBackend to run without Azure.
+# An event that failed ORDER_EVENTS_MAX_ATTEMPTS times is left alone until drain_outbox --retry-failed.
+
+ORDER_EVENTS_BACKEND = os.environ.get("ORDER_EVENTS_BACKEND", "website.sendmessage.ServiceBusBackend")
+ORDER_EVENTS_FILE = os.environ.get("ORDER_EVENTS_FILE", BASE_DIR / "order_events.jsonl")
+ORDER_EVENTS_MAX_ATTEMPTS = 10
+# Seconds the broker has to take a batch, drain_outbox holds the events' row locks until then
+ORDER_EVENTS_SEND_TIMEOUT = 10
 
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')] # during development
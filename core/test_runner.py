@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+# The test runner with an in-memory shared cache, whatever CACHE the environment picks
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_cache = override_settings(CACHES={
+            **settings.CACHES,
+            'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test'},
+        })
+        self.test_cache.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_cache.disable()
+        super().teardown_test_environment(**kwargs)
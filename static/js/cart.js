@@ -7,58 +7,64 @@ for(i = 0; i < updateBtns.length; i++){
         console.log('productId:', productId, 'Action:', action)
 
         console.log('USER:', user)
-        if(user === 'AnonymousUser'){
-            addCookieItem(productId, action)
+        updateCart(productId, action)
+    })
+}
+
+// Guest and user carts both go through the cart API, the server answers with the new totals
+function updateCart(productId, action){
+    var url = '/cart_api/'
+
+    fetch(url, {
+        method: 'POST',
+        headers:{
+            'Content-Type':'application/json',
+            'X-CSRFToken':csrftoken,
+        },
+        body:JSON.stringify({'productId': productId, 'action': action})
+    })
+    .then((response) => {
+        return response.json()
+    })
+    .then((data) => {
+        console.log('data:', data)
+
+        if (data.error) {
+            return
         }
-        else{
-            updateUserOrder(productId, action)
+
+        // Guests keep their cart in a cookie
+        if (data.cart !== undefined) {
+            cart = data.cart
+            document.cookie = 'cart=' + JSON.stringify(cart) + ";domain=;path=/"
         }
-    })
+
+        updateCartView(data)
+    });
 }
 
-function addCookieItem(productId, action) {
-    console.log('User is not authenticated')
+// Update only the cart badge, the changed row and the totals instead of reloading the page
+function updateCartView(data) {
+    document.getElementById('cart-total').textContent = data.cartItems
 
-    if (action == 'add') {
-        if (cart[productId] == undefined) {
-            cart[productId] = {'quantity': 1}
+    var row = document.querySelector('[data-product-row="' + data.productId + '"]')
+    if (row) {
+        if (data.quantity <= 0) {
+            row.remove()
         }
         else {
-            cart[productId]['quantity'] += 1
+            row.querySelector('.line-quantity').textContent = data.quantity
+            row.querySelector('.line-total').textContent = data.lineTotal.toFixed(2) + '€'
         }
     }
 
-    if (action == 'remove') {
-        cart[productId]['quantity'] -= 1
+    var cartItems = document.getElementById('cart-summary-items')
+    if (cartItems) {
+        cartItems.textContent = data.cartItems
+    }
 
-        if (cart[productId]['quantity'] <= 0) {
-            console.log('Item should be deleted')
-            delete cart[productId];
-        }
+    var cartTotal = document.getElementById('cart-summary-total')
+    if (cartTotal) {
+        cartTotal.textContent = data.cartTotal.toFixed(2) + '€'
     }
-    console.log('Cart:', cart)
-    document.cookie = 'cart=' + JSON.stringify(cart) + ";domain=;path=/"
-    location.reload()
 }
-
-function updateUserOrder(productId, action){
-    console.log('User is authenticated, sending data...')
-
-        var url = '/update_item/'
-
-        fetch(url, {
-            method: 'POST',
-            headers:{
-                'Content-Type':'application/json',
-                'X-CSRFToken':csrftoken,
-            },
-            body:JSON.stringify({'productId': productId, 'action': action})
-        })
-        .then((response) => {
-            return response.json()
-        })
-        .then((data) => {
-            console.log('data:', data)
-            location.reload()
-        });
-}
\ No newline at end of file
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Customer, Product, Address, OrderItem, Order, Category, Question, Answer, Challenge
+from .models import User, Customer, Product, Address, OrderItem, Order, OrderEvent, Category, Question, Answer, Challenge, ChallengeAttempt, LeaderboardEntry
 
 admin.site.register(User, UserAdmin)
 admin.site.register(Customer)
@@ -9,6 +9,9 @@ admin.site.register(Product)
 admin.site.register(Category)
 admin.site.register(Order)
 admin.site.register(OrderItem)
+admin.site.register(OrderEvent)
 admin.site.register(Question)
 admin.site.register(Answer)
-admin.site.register(Challenge)
\ No newline at end of file
+admin.site.register(Challenge)
+admin.site.register(ChallengeAttempt)
+admin.site.register(LeaderboardEntry)
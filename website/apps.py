@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class WebsiteConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'website'
+
+    def ready(self):
+        # Connect the receivers that invalidate the store catalogue and daily challenge caches,
+        # keep the forum counters, the search index and the resized image copies
+        from . import catalogue, challenges, forum, images, search
+        post_migrate.connect(search.create_search_tables, sender=self)
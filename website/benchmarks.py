@@ -0,0 +1,128 @@
+import json
+import time
+from io import StringIO
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .models import *
+
+
+DEFAULT_DATASET = {
+    'products': 10000,
+    'questions': 1000,
+    'answers': 50,
+    'cart_lines': 100,
+}
+
+# Scaled dataset from seed_db
+def seed_dataset(products, questions, answers, cart_lines):
+    call_command('seed_db', products=products, questions=questions, answers=answers, users=max(answers, 1) + 1, stdout=StringIO())
+    user = User.objects.get(username='utilizador_teste')
+    question = Question.objects.order_by('id').first()
+    fill_cart(user, cart_lines)
+    return user, question
+
+
+# Give the user an open order with the given number of lines
+def fill_cart(user, cart_lines):
+    order, created = Order.objects.get_or_create(customer=user.customer, complete=False)
+    order.orderitem_set.all().delete()
+    OrderItem.objects.bulk_create(
+        OrderItem(order=order, product=product, quantity=1)
+        for product in Product.objects.order_by('id')[:cart_lines]
+    )
+    return order
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(fraction * (len(values) - 1)))]
+
+
+# Each scenario is (name, setup, request), setup runs before every measured request
+def scenarios(user, question, cart_lines):
+    product = Product.objects.order_by('id').first()
+    state = {}
+
+    def fresh_cart(client):
+        state['total'] = str(fill_cart(user, cart_lines).get_cart_total)
+
+    def process_order(client):
+        # processOrder only completes the order when the total matches
+        data = {
+            'form': {'total': state['total']},
+            'shipping': {'street': 'Rua de Teste', 'city': 'Lisboa', 'postal_code': '1000-001'},
+        }
+        return client.post(reverse('process_order'), json.dumps(data), content_type='application/json')
+
+    # seed_db gives utilizador_teste this password
+    def log_in(client):
+        return client.post(reverse('login'), {'username': user.username, 'password': 'password123'})
+
+    return [
+        ('login', None, log_in),
+        ('store', None, lambda client: client.get(reverse('store'))),
+        ('store (cold cache)', lambda client: cache.clear(), lambda client: client.get(reverse('store'))),
+        ('cart', None, lambda client: client.get(reverse('cart'))),
+        ('checkout', None, lambda client: client.get(reverse('checkout'))),
+        ('forum', None, lambda client: client.get(reverse('forum'))),
+        ('question', None, lambda client: client.get(reverse('question', args=[question.id]))),
+        ('challenge', None, lambda client: client.get(reverse('challenge'))),
+        ('updateItem', None, lambda client: client.post(
+            reverse('update_item'), json.dumps({'productId': product.id, 'action': 'add'}), content_type='application/json')),
+        ('processOrder', fresh_cart, process_order),
+    ]
+
+
+# Query count and p50/p95 render time of every view
+def run_benchmarks(user, question, cart_lines, runs=10):
+    client = Client()
+    client.force_login(user)
+    cache.clear()
+    fill_cart(user, cart_lines)
+
+    results = {}
+    for name, setup, request in scenarios(user, question, cart_lines):
+        # One unmeasured request first, so lazy setup and warm caches don't skew the numbers
+        if setup:
+            setup(client)
+        request(client)
+
+        timings = []
+        queries = 0
+        for _ in range(runs):
+            if setup:
+                setup(client)
+            # The query log is capped, start every capture from an empty one
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = request(client)
+                timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{name} returned {response.status_code}')
+            queries = max(queries, len(context.captured_queries))
+
+        results[name] = {
+            'queries': queries,
+            'p50_ms': round(percentile(timings, 0.5), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+        }
+    return results
+
+
+# Views over their baseline, query counts always, times only with a tolerance
+def compare_to_baseline(results, baseline, time_tolerance=None):
+    failures = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['queries'] > expected['queries']:
+            failures.append(f"{name}: {result['queries']} queries (baseline {expected['queries']})")
+        if time_tolerance is not None and result['p95_ms'] > expected['p95_ms'] * (1 + time_tolerance):
+            failures.append(f"{name}: p95 {result['p95_ms']} ms (baseline {expected['p95_ms']} ms)")
+    return failures
@@ -0,0 +1,222 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+MISSING = object()
+# How often a worker waiting for another one's recompute checks the shared cache
+WAIT_INTERVAL = 0.05
+
+
+class LocalStore:
+    # Bounded LRU of key: (expiry, pickled value), shared by every thread of the process.
+    # Values are pickled like LocMemCache does, so a caller changing what it got doesn't change the cached copy.
+    # The least recently used entry is evicted when it's full.
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.counters = dict.fromkeys(('local_hits', 'shared_hits', 'misses', 'evictions', 'recomputes', 'waits'), 0)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            expires, pickled = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def set(self, key, value, ttl):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, pickled)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    # Lock held by the one thread recomputing the key, the others wait on it
+    def flight(self, key):
+        with self.lock:
+            lock, users = self.flights.get(key, (None, 0))
+            self.flights[key] = (lock or threading.Lock(), users + 1)
+            return self.flights[key][0]
+
+    def land(self, key):
+        with self.lock:
+            lock, users = self.flights[key]
+            if users > 1:
+                self.flights[key] = (lock, users - 1)
+            else:
+                del self.flights[key]
+
+
+# One store per shared cache, Django builds a backend instance per thread.
+# Keyed by the alias and its settings, so override_settings(CACHES=...) doesn't serve values of the old cache.
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+# Cache backend with a small in-process LRU in front of the shared cache named by LOCATION.
+# Reads are served from the process for at most LOCAL_TIMEOUT seconds, so a change made by another
+# worker can take that long to show up here. Writes and deletes go to both tiers.
+# get_or_set recomputes a missing key once: other threads wait on a lock, other workers on a lock key in the shared cache.
+# The lock key is taken with add, which is only atomic if the shared cache's add is (database and memory, not file).
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = location or 'shared'
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self.lock_timeout = options.get('LOCK_TIMEOUT', 10)
+        key = (self.shared_alias, repr(settings.CACHES.get(self.shared_alias)))
+        with _stores_lock:
+            self.store = _stores.setdefault(key, LocalStore(self._max_entries))
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def local_ttl(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return self.local_timeout if timeout is None else min(timeout, self.local_timeout)
+
+    def remember(self, key, value, timeout, version):
+        ttl = self.local_ttl(timeout)
+        if ttl > 0:
+            self.store.set(self.make_and_validate_key(key, version), value, ttl)
+
+    def forget(self, key, version):
+        self.store.delete(self.make_and_validate_key(key, version))
+
+    # Value from either tier without touching the counters
+    def lookup(self, key, version=None):
+        value = self.store.get(self.make_and_validate_key(key, version))
+        if value is MISSING:
+            value = self.shared.get(key, MISSING, version=version)
+            if value is not MISSING:
+                self.remember(key, value, DEFAULT_TIMEOUT, version)
+        return value
+
+    def get(self, key, default=None, version=None):
+        value = self.store.get(self.make_and_validate_key(key, version))
+        if value is not MISSING:
+            self.store.count('local_hits')
+            return value
+
+        value = self.shared.get(key, MISSING, version=version)
+        if value is MISSING:
+            self.store.count('misses')
+            return default
+        self.store.count('shared_hits')
+        self.remember(key, value, DEFAULT_TIMEOUT, version)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        self.remember(key, value, timeout, version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self.remember(key, value, timeout, version)
+        else:
+            # Someone else's value is in the shared cache, don't keep an older local copy
+            self.forget(key, version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.forget(key, version)
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self.forget(key, version)
+        return self.shared.delete(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self.forget(key, version)
+        return self.shared.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self.lookup(key, version) is not MISSING
+
+    def clear(self):
+        self.store.clear()
+        self.shared.clear()
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        value = self.get(key, MISSING, version=version)
+        if value is not MISSING:
+            return value
+        if not callable(default):
+            self.add(key, default, timeout, version=version)
+            return self.get(key, default, version=version)
+
+        local_key = self.make_and_validate_key(key, version)
+        lock = self.store.flight(local_key)
+        try:
+            with lock:
+                # Another thread of this process may have filled it while this one waited
+                value = self.lookup(key, version)
+                if value is not MISSING:
+                    self.store.count('waits')
+                    return value
+
+                lock_key = f'{key}:recompute'
+                owner = self.shared.add(lock_key, 1, self.lock_timeout, version=version)
+                if not owner:
+                    value = self.wait_for(key, lock_key, version)
+                    if value is not MISSING:
+                        self.store.count('waits')
+                        return value
+
+                try:
+                    value = default()
+                    self.store.count('recomputes')
+                    self.set(key, value, timeout, version=version)
+                finally:
+                    if owner:
+                        self.shared.delete(lock_key, version=version)
+                return value
+        finally:
+            self.store.land(local_key)
+
+    # Poll the shared cache while another worker recomputes, give up after LOCK_TIMEOUT
+    def wait_for(self, key, lock_key, version):
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(WAIT_INTERVAL)
+            value = self.lookup(key, version)
+            if value is not MISSING or not self.shared.has_key(lock_key, version=version):
+                return value
+        return MISSING
+
+    def stats(self):
+        with self.store.lock:
+            return {**self.store.counters, 'local_entries': len(self.store.entries)}
+
+    def close(self, **kwargs):
+        # The shared cache is closed by Django with the other aliases
+        pass
@@ -0,0 +1,95 @@
+import hashlib
+import time
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Count
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from .models import Product, Category
+
+
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+CATALOGUE_TIMEOUT = 60 * 60
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 60
+
+
+def parse_int(value, default=None):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+# Number of products of each category id, and of the whole catalogue under None
+def catalogue_counts(version):
+    def count():
+        counts = dict(Category.objects.annotate(products=Count('product')).values_list('id', 'products'))
+        counts[None] = Product.objects.count()
+        return counts
+
+    return cache.get_or_set(f'catalogue:{version}:counts', count, CATALOGUE_TIMEOUT)
+
+
+# Read the category, page and limit from the query string. Unknown categories show every product and
+# pages past the end the last one, as Paginator.get_page does, so junk values share the keys of real pages.
+def catalogue_query(request, version):
+    counts = catalogue_counts(version)
+    category_id = parse_int(request.GET.get('category'))
+    if category_id not in counts:
+        category_id = None
+    limit = min(max(parse_int(request.GET.get('limit'), DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    last_page = max(-(-counts[category_id] // limit), 1)
+    page = min(max(parse_int(request.GET.get('page'), 1), 1), last_page)
+    return {'category_id': category_id, 'page': page, 'limit': limit}
+
+
+# Timestamp of the last change to any product or category, used as the cache version
+def catalogue_version():
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        version = int(time.time())
+        cache.add(CATALOGUE_VERSION_KEY, version, None)
+        version = cache.get(CATALOGUE_VERSION_KEY, version)
+    return version
+
+
+def invalidate_catalogue():
+    # Keys embed the version, so bumping it makes every cached page stale at once
+    cache.set(CATALOGUE_VERSION_KEY, max(int(time.time()), catalogue_version() + 1), None)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def catalogue_changed(sender, **kwargs):
+    invalidate_catalogue()
+
+
+# ETag for the whole store page, the cart badge and user are part of it
+def catalogue_etag(query, version, user, cart_items):
+    key = f"{version}:{query['category_id']}:{query['page']}:{query['limit']}:{user.pk}:{cart_items}"
+    return '"%s"' % hashlib.md5(key.encode()).hexdigest()
+
+
+# Rendered product grid for one category and page, cached until the catalogue changes.
+# get_or_set renders a missing page once even when many requests ask for it at the same time.
+def render_catalogue(query, version):
+    key = f"catalogue:{version}:{query['category_id']}:{query['page']}:{query['limit']}"
+
+    def render():
+        products = Product.objects.order_by('id')
+        if query['category_id']:
+            products = products.filter(category_id=query['category_id'])
+
+        page = Paginator(products, query['limit']).get_page(query['page'])
+
+        return render_to_string('store_catalogue.html', {
+            'page': page,
+            'products': page.object_list,
+            'categories': Category.objects.order_by('id'),
+            'category_id': query['category_id'],
+            'limit': query['limit'],
+        })
+
+    return cache.get_or_set(key, render, CATALOGUE_TIMEOUT)
@@ -0,0 +1,144 @@
+import hashlib
+import re
+from datetime import datetime, time, timedelta
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Challenge, ChallengeAttempt, DailyChallenge
+from .search import fold
+from .leaderboards import record_solved
+
+
+ANSWER_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def daily_challenge_key(day):
+    return f'challenge:daily:{day}'
+
+
+# Seconds left until the midnight that ends the day in TIME_ZONE
+def seconds_until_end_of(day, now=None):
+    now = timezone.localtime(now)
+    midnight = datetime.combine(day + timedelta(days=1), time.min, tzinfo=now.tzinfo)
+    return max(int((midnight - now).total_seconds()), 1)
+
+
+# Same challenge for the same day on every server: the date hashed into the challenges of that day
+def pick_challenge(day):
+    ids = list(Challenge.objects.filter(date=day).order_by('id').values_list('id', flat=True))
+    if not ids:
+        return None
+    digest = hashlib.sha256(day.isoformat().encode()).digest()
+    return ids[int.from_bytes(digest[:8], 'big') % len(ids)]
+
+
+# The stored pick of the day, made the first time the day is asked for
+def schedule_day(day):
+    scheduled = DailyChallenge.objects.select_related('challenge').filter(date=day).first()
+    if scheduled is not None:
+        return scheduled.challenge
+
+    challenge_id = pick_challenge(day)
+    if challenge_id is None:
+        return None
+    try:
+        with transaction.atomic():
+            DailyChallenge.objects.create(date=day, challenge_id=challenge_id)
+    except IntegrityError:
+        # Another request stored the pick first, use theirs
+        return DailyChallenge.objects.select_related('challenge').get(date=day).challenge
+    return Challenge.objects.get(pk=challenge_id)
+
+
+# Challenge of the day, cached until the day is over. Days without challenges aren't cached, so one added later shows up.
+def daily_challenge(day=None):
+    day = day or timezone.localdate()
+    key = daily_challenge_key(day)
+    challenge = cache.get(key)
+    if challenge is None:
+        challenge = schedule_day(day)
+        if challenge is not None:
+            cache.set(key, challenge, seconds_until_end_of(day))
+    return challenge
+
+
+# Date the challenge had before the save, so challenge_changed can clear that day too
+@receiver(pre_save, sender=Challenge)
+def remember_date(sender, instance, raw=False, **kwargs):
+    instance._previous_date = None
+    if instance.pk and not raw:
+        instance._previous_date = Challenge.objects.filter(pk=instance.pk).values_list('date', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Challenge)
+def challenge_changed(sender, instance, **kwargs):
+    if instance.date:
+        cache.delete(daily_challenge_key(instance.date))
+
+    previous = getattr(instance, '_previous_date', None)
+    if previous and previous != instance.date:
+        # Moved to another day, the old day picks again among the challenges it has left
+        DailyChallenge.objects.filter(date=previous, challenge=instance).delete()
+        cache.delete(daily_challenge_key(previous))
+
+
+# Lower case, no accents, punctuation or extra spaces: " Fotossíntese! " becomes "fotossintese"
+def normalize_answer(text):
+    return ' '.join(ANSWER_TOKEN_RE.findall(fold(text)))
+
+
+def accepted_answers(challenge):
+    answers = map(normalize_answer, [challenge.correct_answer, *challenge.synonyms.splitlines()])
+    return list(dict.fromkeys(answer for answer in answers if answer))
+
+
+@receiver(pre_save, sender=Challenge)
+def normalize_challenge(sender, instance, **kwargs):
+    instance.normalized_answers = accepted_answers(instance)
+
+
+def is_correct(challenge, answer):
+    # Rows written with bulk_create have no normalized answers yet
+    return normalize_answer(answer) in (challenge.normalized_answers or accepted_answers(challenge))
+
+
+# Record the user's answer to the challenge of the day. Once it's right, later answers don't count.
+def grade_answer(user, challenge, answer, day=None):
+    day = day or timezone.localdate()
+    correct = is_correct(challenge, answer)
+
+    with transaction.atomic():
+        attempt, created = ChallengeAttempt.objects.select_for_update().get_or_create(
+            user=user, date=day, defaults={'challenge': challenge},
+        )
+        if not attempt.correct:
+            attempt.attempts += 1
+            attempt.correct = correct
+            attempt.answered_at = timezone.now()
+            attempt.save(update_fields=['attempts', 'correct', 'answered_at'])
+            if correct:
+                record_solved(user.pk, day, attempt.attempts, attempt.answered_at)
+    return attempt
+
+
+# Days in a row with a right answer, up to today, or yesterday while today isn't answered yet.
+# Reads the user's days newest first from the (user, date) index and stops at the first gap.
+def current_streak(user, today=None):
+    today = today or timezone.localdate()
+    days = (
+        ChallengeAttempt.objects.filter(user=user, correct=True, date__lte=today)
+        .order_by('-date').values_list('date', flat=True)
+    )
+
+    streak = 0
+    expected = today
+    for day in days.iterator(chunk_size=100):
+        if streak == 0 and day == today - timedelta(days=1):
+            expected = day
+        if day != expected:
+            break
+        streak += 1
+        expected -= timedelta(days=1)
+    return streak
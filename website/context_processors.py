@@ -0,0 +1,7 @@
+from django.utils.functional import SimpleLazyObject
+from .utils import cachedCartSummary
+
+
+# Cart badge of the navbar on every page. Lazy, so views that pass their own cartItems don't read it twice.
+def cart(request):
+    return {'cartItems': SimpleLazyObject(lambda: cachedCartSummary(request)['cartItems'])}
@@ -0,0 +1,160 @@
+import base64
+import time
+from datetime import datetime
+from django.core.cache import cache
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from .models import Question, Answer
+
+
+FORUM_PAGE_SIZE = 20
+ANSWER_PAGE_SIZE = 20
+ANSWERS_TIMEOUT = 60 * 60
+
+# Field the forum can be sorted by, newest first
+FORUM_ORDERINGS = {
+    'recent': 'created_at',
+    'activity': 'last_activity_at',
+}
+
+
+# Opaque cursor holding the (sort field, id) of the last row shown
+def encode_position(value, pk):
+    return base64.urlsafe_b64encode(f'{value.isoformat()}|{pk}'.encode()).decode()
+
+
+def encode_cursor(obj, field='created_at'):
+    return encode_position(getattr(obj, field), obj.id)
+
+
+def decode_cursor(cursor):
+    try:
+        value, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(value), int(pk)
+    except (AttributeError, ValueError, UnicodeError):
+        return None
+
+
+# Questions sorted newest first by the given field, after the (value, id) position when given.
+# Seeking on (field, id) uses the index, so deep pages cost the same as the first one.
+def forum_queryset(position=None, field='created_at'):
+    questions = Question.objects.select_related('user').order_by(f'-{field}', '-id')
+
+    if position:
+        value, pk = position
+        questions = questions.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk}))
+    return questions
+
+
+def forum_page(cursor=None, limit=FORUM_PAGE_SIZE, sort='recent'):
+    field = FORUM_ORDERINGS.get(sort, FORUM_ORDERINGS['recent'])
+    questions = forum_queryset(decode_cursor(cursor) if cursor else None, field)
+
+    # One extra row tells whether there is a next page
+    questions = list(questions[:limit + 1])
+    next_cursor = encode_cursor(questions[limit - 1], field) if len(questions) > limit else None
+    return questions[:limit], next_cursor
+
+
+# Answers of a question oldest first, after the (created_at, id) position when given.
+# Uses the (question, created_at, id) index and loads the authors in the same query.
+def answers_queryset(question_id, position=None):
+    answers = Answer.objects.filter(question_id=question_id).select_related('user').order_by('created_at', 'id')
+
+    if position:
+        value, pk = position
+        answers = answers.filter(Q(created_at__gt=value) | Q(created_at=value, id__gt=pk))
+    return answers
+
+
+def answers_page(question_id, cursor=None, limit=ANSWER_PAGE_SIZE):
+    answers = answers_queryset(question_id, decode_cursor(cursor) if cursor else None)
+
+    # One extra row tells whether there is a next page
+    answers = list(answers[:limit + 1])
+    next_cursor = encode_cursor(answers[limit - 1]) if len(answers) > limit else None
+    return answers[:limit], next_cursor
+
+
+def answers_version_key(question_id):
+    return f'question:{question_id}:answers:version'
+
+
+# Timestamp of the last change to the question's answers, used as the cache version
+def answers_version(question_id):
+    key = answers_version_key(question_id)
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time())
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+def invalidate_answers(question_id):
+    # Keys embed the version, so bumping it makes every cached page of the question stale at once
+    cache.set(answers_version_key(question_id), max(int(time.time()), answers_version(question_id) + 1), None)
+
+
+# Rendered page of answers, cached until an answer of the question is posted, edited or deleted
+def render_answers(question_id, cursor=None):
+    # Keyed on the decoded position, so any string in ?cursor= maps to a real page and a short key.
+    # Invalid cursors show the first page.
+    position = decode_cursor(cursor) if cursor else None
+    cursor = encode_position(*position) if position else ''
+    key = f'question:{question_id}:answers:{answers_version(question_id)}:{cursor}'
+
+    def render():
+        answers, next_cursor = answers_page(question_id, cursor)
+        return render_to_string('question_answers.html', {
+            'question_id': question_id,
+            'answers': answers,
+            'next_cursor': next_cursor,
+            'cursor': cursor,
+        })
+
+    return cache.get_or_set(key, render, ANSWERS_TIMEOUT)
+
+
+# Latest answer of the question, or the question itself when it has none
+def last_activity():
+    latest = Answer.objects.filter(question=OuterRef('pk')).order_by().values('question').annotate(latest=Max('created_at')).values('latest')
+    return Coalesce(Subquery(latest), F('created_at'))
+
+
+@receiver(post_save, sender=Answer)
+def answer_created(sender, instance, created, **kwargs):
+    if instance.question_id:
+        invalidate_answers(instance.question_id)
+    if created and instance.question_id:
+        Question.objects.filter(pk=instance.question_id).update(
+            answer_count=F('answer_count') + 1,
+            last_activity_at=instance.created_at,
+        )
+
+
+@receiver(post_delete, sender=Answer)
+def answer_deleted(sender, instance, **kwargs):
+    if instance.question_id:
+        invalidate_answers(instance.question_id)
+        Question.objects.filter(pk=instance.question_id).update(
+            answer_count=F('answer_count') - 1,
+            last_activity_at=last_activity(),
+        )
+
+
+# Rebuild the counters from the Answer table, one range of ids at a time
+def recount_answers(batch_size=10000):
+    count = Answer.objects.filter(question=OuterRef('pk')).order_by().values('question').annotate(count=Count('id')).values('count')
+    last_id = Question.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    updated = 0
+    for start in range(0, last_id, batch_size):
+        updated += Question.objects.filter(id__gt=start, id__lte=start + batch_size).update(
+            answer_count=Coalesce(Subquery(count), 0),
+            last_activity_at=last_activity(),
+        )
+    return updated
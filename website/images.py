@@ -0,0 +1,179 @@
+import logging
+import os
+import queue
+import threading
+from io import BytesIO
+from PIL import Image, ImageOps
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .catalogue import invalidate_catalogue
+from .models import Product, Question, Challenge
+
+
+# Widths of the resized copies, never wider than the original
+VARIANT_WIDTHS = [320, 640, 1280]
+# Format name in image_variants: (Pillow format, file extension, save options)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+logger = logging.getLogger(__name__)
+
+
+# "product/rosa.png" at 320 pixels in WebP is stored next to it as "product/rosa_320w.webp"
+def variant_name(name, width, extension):
+    return f'{os.path.splitext(name)[0]}_{width}w.{extension}'
+
+
+def open_image(image):
+    with image.storage.open(image.name, 'rb') as file:
+        picture = ImageOps.exif_transpose(Image.open(file))
+        picture.load()
+
+    if picture.mode in ('RGBA', 'LA') or (picture.mode == 'P' and 'transparency' in picture.info):
+        # JPEG has no transparency, put the image over a white background
+        picture = picture.convert('RGBA')
+        background = Image.new('RGB', picture.size, (255, 255, 255))
+        background.paste(picture, mask=picture.getchannel('A'))
+        return background
+    return picture.convert('RGB')
+
+
+# Resize the image to every width and format and save the copies in the image's storage
+def generate_variants(image):
+    picture = open_image(image)
+    variants = {'source': image.name, 'width': picture.width}
+
+    for width in sorted({min(width, picture.width) for width in VARIANT_WIDTHS}):
+        height = max(round(picture.height * width / picture.width), 1)
+        resized = picture.resize((width, height), Image.LANCZOS) if width < picture.width else picture
+
+        for name, (format, extension, options) in VARIANT_FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, format, **options)
+            saved = image.storage.save(variant_name(image.name, width, extension), ContentFile(buffer.getvalue()))
+            variants.setdefault(name, {})[str(width)] = saved
+    return variants
+
+
+# Delete the copies listed in image_variants, except the ones also listed in keep
+def delete_variants(storage, variants, keep=None):
+    kept = {name for format in VARIANT_FORMATS for name in (keep or {}).get(format, {}).values()}
+    for format in VARIANT_FORMATS:
+        for name in variants.get(format, {}).values():
+            if name not in kept:
+                storage.delete(name)
+
+
+# Generate the variants of one row, unless its image was changed or removed in the meantime
+def process_image(model, pk):
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not instance.image:
+        return False
+
+    storage = instance.image.storage
+    variants = generate_variants(instance.image)
+    updated = model.objects.filter(pk=pk, image=instance.image.name).update(image_variants=variants)
+    if not updated:
+        # The image changed while these were generated, the new one gets its own
+        delete_variants(storage, variants)
+        return False
+
+    # The copies of the image this one replaced
+    delete_variants(storage, instance.image_variants, keep=variants)
+    if model is Product:
+        # update() skips the signals, the cached store pages still point at the original
+        invalidate_catalogue()
+    return True
+
+
+class VariantWorker:
+    # Rows waiting for variants go into a bounded queue, one background thread resizes them
+    def __init__(self, handler=process_image, max_queue=100):
+        self.handler = handler
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='image-variants', daemon=True)
+                self.thread.start()
+
+    # Returns False when the queue is full, generate_image_variants picks those rows up later
+    def submit(self, model, pk):
+        self.start()
+        try:
+            self.queue.put_nowait((model._meta.label, pk))
+            return True
+        except queue.Full:
+            logger.warning('Image variant queue is full, skipped %s %s', model._meta.label, pk)
+            return False
+
+    def run(self):
+        while True:
+            label, pk = self.queue.get()
+            try:
+                self.handler(apps.get_model(label), pk)
+            except Exception:
+                logger.exception('Failed to generate image variants for %s %s', label, pk)
+            finally:
+                close_old_connections()
+                self.queue.task_done()
+
+    # Wait until every queued row was processed
+    def flush(self, timeout=None):
+        with self.queue.all_tasks_done:
+            return self.queue.all_tasks_done.wait_for(lambda: not self.queue.unfinished_tasks, timeout)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_variant_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = VariantWorker(max_queue=settings.IMAGE_VARIANTS_QUEUE_SIZE)
+        return _worker
+
+
+def schedule_variants(model, pk):
+    if settings.IMAGE_VARIANTS_ASYNC:
+        get_variant_worker().submit(model, pk)
+    else:
+        process_image(model, pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=Challenge)
+def image_saved(sender, instance, **kwargs):
+    name = instance.image.name if instance.image else ''
+    if instance.image_variants.get('source', '') == name:
+        return
+
+    if not name:
+        # Image was removed, forget the copies of the old one
+        sender.objects.filter(pk=instance.pk).update(image_variants={})
+        storage, variants = instance.image.storage, instance.image_variants
+        transaction.on_commit(lambda: delete_variants(storage, variants))
+        return
+
+    # After the commit, so the worker's own connection can see the new row
+    transaction.on_commit(lambda: schedule_variants(sender, instance.pk))
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=Challenge)
+def image_deleted(sender, instance, **kwargs):
+    storage, variants = instance.image.storage, instance.image_variants
+    transaction.on_commit(lambda: delete_variants(storage, variants))
@@ -0,0 +1,114 @@
+from datetime import date, timedelta
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Q
+from .models import ChallengeAttempt, LeaderboardEntry
+
+
+PERIODS = ('day', 'week', 'all')
+# period_start of the all-time board
+ALL_TIME = date(2000, 1, 1)
+
+
+# First day of the day, week (from Monday) or all-time board that holds the given day
+def period_start(period, day):
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    return ALL_TIME
+
+
+def add_to_entry(period, start, user_id, solved, attempts, solved_at):
+    entries = LeaderboardEntry.objects.filter(period=period, period_start=start, user_id=user_id)
+    if entries.update(solved=F('solved') + solved, attempts=F('attempts') + attempts, solved_at=solved_at):
+        return
+    try:
+        with transaction.atomic():
+            LeaderboardEntry.objects.create(
+                period=period, period_start=start, user_id=user_id, solved=solved, attempts=attempts, solved_at=solved_at,
+            )
+    except IntegrityError:
+        # Another request created the entry first
+        entries.update(solved=F('solved') + solved, attempts=F('attempts') + attempts, solved_at=solved_at)
+
+
+# Called once per solved day with the attempts it took and when, adds it to the day, week and all-time boards.
+# Deleting attempts isn't tracked, rebuild_leaderboards recounts everything.
+def record_solved(user_id, day, attempts, solved_at):
+    for period in PERIODS:
+        add_to_entry(period, period_start(period, day), user_id, 1, attempts, solved_at)
+
+
+# Top users of the board holding the given day: most days solved, then fewest attempts, then the quickest.
+# On the daily board that's who answered first, on the others who reached their total first.
+def leaderboard(period, day, limit=10):
+    return list(
+        LeaderboardEntry.objects.filter(period=period, period_start=period_start(period, day))
+        .select_related('user').order_by('-solved', 'attempts', 'solved_at', 'user_id')[:limit]
+    )
+
+
+# Replace one board with its recount in its own transaction, so other writes only wait for this board
+def write_board(period, start, totals, batch_size):
+    # MySQL finds the conflicting row by itself and doesn't accept the unique fields
+    unique_fields = ['period', 'period_start', 'user'] if connections[LeaderboardEntry.objects.db].features.supports_update_conflicts_with_target else None
+    with transaction.atomic():
+        LeaderboardEntry.objects.filter(period=period, period_start=start).delete()
+        LeaderboardEntry.objects.bulk_create(
+            (LeaderboardEntry(period=period, period_start=start, user_id=user_id, solved=solved, attempts=attempts, solved_at=solved_at)
+             for user_id, (solved, attempts, solved_at) in totals.items()),
+            batch_size=batch_size,
+            # An answer graded since the delete may have created the entry again, the recount replaces it
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=['solved', 'attempts', 'solved_at'],
+        )
+
+
+# Recount every board from the attempts, reading them in (date, id) order one chunk at a time.
+# Day and week boards are written as soon as the stream moves past them, so only the all-time
+# board (one row per user) is held in memory. Each board is replaced on its own: readers see
+# either its old or its new entries, never an empty board.
+def rebuild_leaderboards(batch_size=10000):
+    boards = {'day': (None, {}), 'week': (None, {}), 'all': (ALL_TIME, {})}
+    rebuilt = {period: set() for period in PERIODS}
+    written = 0
+
+    def flush(period):
+        nonlocal written
+        start, totals = boards[period]
+        write_board(period, start, totals, batch_size)
+        rebuilt[period].add(start)
+        written += len(totals)
+
+    attempts = ChallengeAttempt.objects.filter(correct=True).order_by('date', 'id')
+    position = None
+    while True:
+        chunk = attempts
+        if position:
+            last_date, last_id = position
+            chunk = chunk.filter(Q(date__gt=last_date) | Q(date=last_date, id__gt=last_id))
+        chunk = list(chunk.values_list('id', 'date', 'user_id', 'attempts', 'answered_at')[:batch_size])
+        if not chunk:
+            break
+
+        for pk, day, user_id, count, answered_at in chunk:
+            for period in PERIODS:
+                start = period_start(period, day)
+                if boards[period][0] != start:
+                    if boards[period][0] is not None:
+                        flush(period)
+                    boards[period] = (start, {})
+                totals = boards[period][1]
+                solved, total, solved_at = totals.get(user_id, (0, 0, answered_at))
+                totals[user_id] = (solved + 1, total + count, max(solved_at, answered_at))
+        position = chunk[-1][1], chunk[-1][0]
+
+    for period in PERIODS:
+        if boards[period][0] is not None:
+            flush(period)
+
+    # Boards of days and weeks that no longer have a solved attempt
+    for period, starts in rebuilt.items():
+        LeaderboardEntry.objects.filter(period=period).exclude(period_start__in=starts).delete()
+    return written
@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment, override_settings
+from website.benchmarks import DEFAULT_DATASET, seed_dataset, run_benchmarks, compare_to_baseline
+from pathlib import Path
+import json
+
+BASELINE_FILE = Path(__file__).resolve().parents[2] / 'benchmark_baseline.json'
+
+class Command(BaseCommand):
+    help = 'Mede o número de consultas e o tempo de resposta de cada vista numa base de dados de teste'
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_DATASET.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+        parser.add_argument('--runs', type=int, default=10, help='Pedidos medidos por vista')
+        parser.add_argument('--baseline', default=str(BASELINE_FILE), help='Ficheiro JSON com os valores de referência')
+        parser.add_argument('--update-baseline', action='store_true', help='Guarda os resultados como nova referência')
+        parser.add_argument('--time-tolerance', type=float, default=None, help='Falha se o p95 exceder a referência nesta fração, ex. 0.5')
+        parser.add_argument('--output', help='Ficheiro onde guardar os resultados em JSON')
+
+    def handle(self, *args, **options):
+        dataset = {name: options[name] for name in DEFAULT_DATASET}
+
+        # Runs against a throwaway test database and cache, the configured ones are never touched
+        setup_test_environment(debug=False)
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(CACHES={**settings.CACHES, 'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+                user, question = seed_dataset(**dataset)
+                results = run_benchmarks(user, question, dataset['cart_lines'], runs=options['runs'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {'vendor': connection.vendor, 'dataset': dataset, 'runs': options['runs'], 'views': results}
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+
+        if options['output']:
+            Path(options['output']).write_text(output + '\n')
+
+        baseline_file = Path(options['baseline'])
+        if options['update_baseline']:
+            baseline_file.write_text(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f'✅ Referência guardada em {baseline_file}'))
+            return
+
+        if not baseline_file.exists():
+            return
+
+        baseline = json.loads(baseline_file.read_text())
+        if baseline.get('dataset') != dataset:
+            self.stdout.write(self.style.WARNING('A referência foi medida com outro conjunto de dados, comparação ignorada'))
+            return
+
+        failures = compare_to_baseline(results, baseline['views'], options['time_tolerance'])
+        if failures:
+            raise CommandError('Regressões em relação à referência:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('✅ Sem regressões em relação à referência'))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from website.outbox import drain_batch, retry_failed
+import time
+
+class Command(BaseCommand):
+    help = 'Envia para a fila de mensagens os eventos de encomendas que ainda não foram enviados'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Eventos enviados por lote')
+        parser.add_argument('--loop', action='store_true', help='Continua a correr e verifica novos eventos')
+        parser.add_argument('--interval', type=float, default=5, help='Segundos entre verificações com --loop')
+        parser.add_argument('--max-interval', type=float, default=300, help='Espera máxima entre tentativas quando o envio falha')
+        parser.add_argument('--retry-failed', action='store_true', help='Volta a tentar os eventos que falharam demasiadas vezes')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            self.stdout.write(f'{retry_failed()} eventos voltam a ser enviados')
+
+        total = 0
+        failures = 0
+        while True:
+            sent, failed = drain_batch(options['batch_size'])
+            total += sent
+
+            if failed and not options['loop']:
+                raise CommandError(f'Não foi possível enviar {failed} eventos ({total} enviados)')
+
+            if sent == 0 or failed:
+                if not options['loop']:
+                    break
+                failures = failures + 1 if failed else 0
+                delay = options['interval']
+                if failures:
+                    # Each failed pass in a row doubles the wait for the broker, up to --max-interval
+                    delay = min(delay * 2 ** failures, options['max_interval'])
+                time.sleep(delay)
+            else:
+                failures = 0
+
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} eventos enviados'))
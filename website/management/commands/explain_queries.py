@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from website.models import *
+from website.forum import forum_queryset, answers_queryset, FORUM_PAGE_SIZE, ANSWER_PAGE_SIZE
+from datetime import date
+import json
+
+# The hottest lookups of the store, forum and challenge views
+HOT_QUERIES = {
+    'Encomenda aberta': lambda: Order.objects.filter(customer_id=1, complete=False),
+    'Artigo da encomenda': lambda: OrderItem.objects.filter(order_id=1, product_id=1),
+    'Morada da encomenda': lambda: Address.objects.filter(order_id=1),
+    'Respostas da pergunta': lambda: answers_queryset(1, (timezone.now(), 1))[:ANSWER_PAGE_SIZE + 1],
+    'Desafio do dia': lambda: Challenge.objects.filter(date=date.today()),
+    'Desafio escolhido do dia': lambda: DailyChallenge.objects.filter(date=date.today()),
+    'Sequência do utilizador': lambda: ChallengeAttempt.objects.filter(user_id=1, correct=True, date__lte=date.today()).order_by('-date'),
+    'Melhores da semana': lambda: LeaderboardEntry.objects.filter(period='week', period_start=date.today()).order_by('-solved', 'attempts', 'solved_at', 'user_id')[:10],
+    'Página do fórum': lambda: forum_queryset((timezone.now(), 1))[:FORUM_PAGE_SIZE + 1],
+    'Fórum por atividade': lambda: forum_queryset((timezone.now(), 1), 'last_activity_at')[:FORUM_PAGE_SIZE + 1],
+}
+
+
+# Whether the plan reads the table through an index instead of a full scan
+def uses_index(plan):
+    if connection.vendor == 'mysql':
+        tables = []
+
+        def collect(node):
+            if isinstance(node, dict):
+                if 'table' in node and isinstance(node['table'], dict):
+                    tables.append(node['table'])
+                for value in node.values():
+                    collect(value)
+            elif isinstance(node, list):
+                for value in node:
+                    collect(value)
+
+        collect(json.loads(plan))
+        return bool(tables) and all(table.get('key') and table.get('access_type') != 'ALL' for table in tables)
+
+    # SQLite: "SEARCH ... USING INDEX" or "USING INTEGER PRIMARY KEY", a plain "SCAN" means a full scan
+    lines = [line for line in plan.splitlines() if 'SCAN' in line or 'SEARCH' in line]
+    return bool(lines) and all('USING' in line and ('INDEX' in line or 'PRIMARY KEY' in line) for line in lines)
+
+
+class Command(BaseCommand):
+    help = 'Corre EXPLAIN nas consultas mais usadas e indica se usam um índice'
+
+    def handle(self, *args, **options):
+        explain_options = {'format': 'JSON'} if connection.vendor == 'mysql' else {}
+        missing = 0
+
+        for name, queryset in HOT_QUERIES.items():
+            plan = queryset().explain(**explain_options)
+            if uses_index(plan):
+                self.stdout.write(self.style.SUCCESS(f'✅ {name}: usa índice'))
+            else:
+                missing += 1
+                self.stdout.write(self.style.WARNING(f'❌ {name}: sem índice'))
+
+            if options['verbosity'] > 1:
+                self.stdout.write(plan)
+
+        self.stdout.write(f'{len(HOT_QUERIES) - missing}/{len(HOT_QUERIES)} consultas usam índice ({connection.vendor})')
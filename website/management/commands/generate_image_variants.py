@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from website.models import Product, Question, Challenge
+from website.images import process_image
+
+class Command(BaseCommand):
+    help = 'Gera as versões redimensionadas (WebP e JPEG) das imagens que ainda não as têm'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Gerar de novo mesmo as que já existem')
+
+    def handle(self, *args, **options):
+        generated = 0
+        for model in (Product, Question, Challenge):
+            rows = model.objects.exclude(image='').exclude(image__isnull=True).values_list('id', 'image', 'image_variants')
+            for pk, image, variants in rows.iterator():
+                if options['force'] or (variants or {}).get('source') != image:
+                    if process_image(model, pk):
+                        generated += 1
+        self.stdout.write(self.style.SUCCESS(f'✅ {generated} imagens processadas'))
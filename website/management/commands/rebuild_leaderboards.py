@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from website.leaderboards import rebuild_leaderboards
+
+class Command(BaseCommand):
+    help = 'Recalcula as classificações diária, semanal e geral a partir das respostas aos desafios'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Respostas lidas de cada vez')
+
+    def handle(self, *args, **options):
+        written = rebuild_leaderboards(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'✅ {written} entradas de classificação'))
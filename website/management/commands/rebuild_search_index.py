@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from website.search import SEARCH_KINDS, create_search_tables, rebuild_index
+
+class Command(BaseCommand):
+    help = 'Reconstrói o índice de pesquisa de produtos e perguntas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Documentos indexados de cada vez')
+
+    def handle(self, *args, **options):
+        create_search_tables()
+        for kind in SEARCH_KINDS:
+            indexed = rebuild_index(kind, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'✅ {indexed} documentos indexados ({kind})'))
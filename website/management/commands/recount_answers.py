@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from website.forum import recount_answers
+
+class Command(BaseCommand):
+    help = 'Recalcula o número de respostas e a última atividade de todas as perguntas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Perguntas atualizadas por UPDATE')
+
+    def handle(self, *args, **options):
+        updated = recount_answers(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'✅ {updated} perguntas atualizadas'))
@@ -0,0 +1,24 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from website.challenges import daily_challenge
+
+class Command(BaseCommand):
+    help = 'Escolhe e guarda o desafio diário dos próximos dias'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Número de dias, a começar hoje')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        scheduled = 0
+        for offset in range(options['days']):
+            day = today + timedelta(days=offset)
+            challenge = daily_challenge(day)
+            if challenge is None:
+                self.stdout.write(f'{day}: sem desafios')
+            else:
+                scheduled += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{day}: {challenge.text}')
+        self.stdout.write(self.style.SUCCESS(f'✅ {scheduled} dias com desafio escolhido'))
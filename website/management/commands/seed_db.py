@@ -1,95 +1,252 @@
+from django.core.cache import cache
 from django.core.management.base import BaseCommand
+from django.contrib.auth.hashers import make_password
+from django.db import models
 from website.models import *
-from datetime import date
+from website.images import delete_variants
+from website.forum import recount_answers
+from website.search import SEARCH_KINDS, rebuild_index
+from website.challenges import normalize_answer
+from datetime import date, timedelta
+from itertools import islice
 import random
+import time
+
+CATEGORIES = [
+    "Ervas",
+    "Flores",
+    "Suculentas",
+    "Árvores",
+    "Frutas",
+    "Legumes"
+]
+
+PRODUCTS = [
+    {"name": "Óleo de Lavanda", "price": 12.99, "desc": "Óleo aromático extraído de lavanda.", "image": "https://images-na.ssl-images-amazon.com/images/I/51KFx9JV7GL._SL1000_.jpg"},
+    {"name": "Sementes de Rosa", "price": 4.50, "desc": "Sementes de rosa de alta qualidade."},
+    {"name": "Vaso com Cacto", "price": 9.99, "desc": "Cacto em vaso, ideal para decoração."},
+    {"name": "Árvore Bonsai", "price": 29.99, "desc": "Árvore bonsai em miniatura para interior."},
+    {"name": "Planta de Tomate", "price": 5.25, "desc": "Planta de tomate pronta para ser plantada."},
+    {"name": "Folhas de Manjericão", "price": 3.75, "desc": "Folhas de manjericão frescas."},
+    {"name": "Hortelã", "price": 3.25, "desc": "Planta de hortelã refrescante."},
+    {"name": "Sementes de Girassol", "price": 2.99, "desc": "Sementes de girassol para plantar ou petiscar."},
+    {"name": "Muda de Limoeiro", "price": 15.00, "desc": "Muda jovem de limoeiro."},
+    {"name": "Gel de Aloé Vera", "price": 7.99, "desc": "Gel natural de aloé vera."},
+]
+
+QUESTIONS = [
+    {
+        "title": "Como posso propagar suculentas?",
+        "body": "Já ouvi dizer que é fácil, mas não sei bem por onde começar. Alguém tem dicas?",
+        "answer": "Corta uma folha saudável e coloca-a sobre terra seca. Deve criar raízes em uma ou duas semanas.",
+    },
+    {
+        "title": "Porque é que as folhas do meu manjericão estão a ficar castanhas?",
+        "body": "Estavam bem na semana passada. Tenho regado com frequência.",
+        "answer": "Pode ser excesso de água ou algum fungo. Reduz a rega e verifica se há pragas.",
+    },
+]
+
+CHALLENGES = [
+    {"text": "Que parte da planta é responsável pela fotossíntese?", "answer": "Folhas"},
+    {"text": "Como se chama uma planta que completa o ciclo de vida numa só estação?", "answer": "Anuais"},
+]
+
+GENERATED_USER_PREFIX = 'utilizador_'
+GENERATED_ORDER_PREFIX = 'seed-'
+
+
+# Split a generator into lists of at most size items, so large datasets never sit in memory at once
+def chunked(objects, size):
+    objects = iter(objects)
+    while True:
+        chunk = list(islice(objects, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Delete the rows and everything that cascades from them with one DELETE per table, without loading them
+# or sending signals. The command rebuilds what the receivers keep (index, counters, cache) afterwards.
+def clear(queryset):
+    for relation in queryset.model._meta.get_fields(include_hidden=True):
+        if not (relation.auto_created and not relation.concrete and (relation.one_to_many or relation.one_to_one)):
+            continue
+        related = relation.related_model._base_manager.filter(**{f'{relation.field.name}__in': queryset})
+        if relation.on_delete is models.CASCADE:
+            clear(related)
+        elif relation.on_delete is models.SET_NULL:
+            related.update(**{relation.field.name: None})
+    queryset._raw_delete(queryset.db)
+
+
+# Delete the resized copies of the images of the rows about to be cleared
+def clear_variants(queryset):
+    storage = queryset.model._meta.get_field('image').storage
+    for variants in queryset.exclude(image_variants={}).values_list('image_variants', flat=True).iterator():
+        delete_variants(storage, variants)
+
 
 class Command(BaseCommand):
     help = 'Preenche a base de dados com dados de exemplo (categorias, produtos, perguntas, respostas e desafios)'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=len(PRODUCTS), help='Número de produtos')
+        parser.add_argument('--users', type=int, default=1, help='Número de utilizadores, incluindo o utilizador de teste')
+        parser.add_argument('--questions', type=int, default=len(QUESTIONS), help='Número de perguntas')
+        parser.add_argument('--answers', type=int, default=1, help='Respostas por pergunta')
+        parser.add_argument('--orders', type=int, default=0, help='Número de encomendas concluídas')
+        parser.add_argument('--challenges-per-day', type=int, default=len(CHALLENGES), help='Desafios por dia')
+        parser.add_argument('--days', type=int, default=1, help='Dias com desafios, a começar hoje')
+        parser.add_argument('--seed', type=int, default=42, help='Semente dos dados aleatórios')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Linhas por INSERT')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.counts = {}
+
+        start = time.perf_counter()
+
         # Limpar dados antigos (opcional)
-        Category.objects.all().delete()
-        Product.objects.all().delete()
-        Question.objects.all().delete()
-        Answer.objects.all().delete()
-        Challenge.objects.all().delete()
+        for model in (Product, Question, Challenge):
+            clear_variants(model.objects.all())
+        clear(Answer.objects.all())
+        clear(Question.objects.all())
+        clear(Challenge.objects.all())
+        clear(Order.objects.filter(transaction_id__startswith=GENERATED_ORDER_PREFIX))
+        clear(Product.objects.all())
+        clear(Category.objects.all())
+        clear(User.objects.filter(username__startswith=GENERATED_USER_PREFIX).exclude(username='utilizador_teste'))
 
         # === Criar Categorias ===
-        categories = [
-            "Ervas",
-            "Flores",
-            "Suculentas",
-            "Árvores",
-            "Frutas",
-            "Legumes"
-        ]
-        category_objs = []
-        for name in categories:
-            cat = Category.objects.create(name=name)
-            category_objs.append(cat)
+        self.insert(Category, (Category(name=name) for name in CATEGORIES))
+        category_ids = list(Category.objects.values_list('id', flat=True))
 
         # === Criar Produtos ===
-        products = [
-            {"name": "Óleo de Lavanda", "price": 12.99, "desc": "Óleo aromático extraído de lavanda.", "image": "https://images-na.ssl-images-amazon.com/images/I/51KFx9JV7GL._SL1000_.jpg"},
-            {"name": "Sementes de Rosa", "price": 4.50, "desc": "Sementes de rosa de alta qualidade."},
-            {"name": "Vaso com Cacto", "price": 9.99, "desc": "Cacto em vaso, ideal para decoração."},
-            {"name": "Árvore Bonsai", "price": 29.99, "desc": "Árvore bonsai em miniatura para interior."},
-            {"name": "Planta de Tomate", "price": 5.25, "desc": "Planta de tomate pronta para ser plantada."},
-            {"name": "Folhas de Manjericão", "price": 3.75, "desc": "Folhas de manjericão frescas."},
-            {"name": "Hortelã", "price": 3.25, "desc": "Planta de hortelã refrescante."},
-            {"name": "Sementes de Girassol", "price": 2.99, "desc": "Sementes de girassol para plantar ou petiscar."},
-            {"name": "Muda de Limoeiro", "price": 15.00, "desc": "Muda jovem de limoeiro."},
-            {"name": "Gel de Aloé Vera", "price": 7.99, "desc": "Gel natural de aloé vera."},
-        ]
-
-        for p in products:
-            Product.objects.create(
-                name=p["name"],
-                category=random.choice(category_objs),
-                price=p["price"],
-                description=p["desc"]
-            )
-
-        # === Criar utilizador de teste ===
+        self.insert(Product, (self.product(i, category_ids) for i in range(options['products'])))
+        product_ids = list(Product.objects.values_list('id', flat=True))
+
+        # === Criar utilizadores ===
         user, _ = User.objects.get_or_create(username="utilizador_teste")
         user.set_password("password123")
         user.save()
 
+        # Every generated user shares one password hash, hashing is the slow part of creating users
+        password = make_password("password123")
+        self.insert(User, (
+            User(username=f'{GENERATED_USER_PREFIX}{i}', password=password)
+            for i in range(1, options['users'])
+        ))
+        user_ids = list(User.objects.filter(username__startswith=GENERATED_USER_PREFIX).values_list('id', flat=True))
+
+        # bulk_create skips the post_save signal, so create the customers here
+        self.insert(Customer, (
+            Customer(user_id=user_id, name=username, email=f'{username}@example.com')
+            for user_id, username in User.objects.filter(customer__isnull=True).values_list('id', 'username').iterator()
+        ))
+
         # === Criar Perguntas e Respostas ===
-        q1 = Question.objects.create(
-            user=user,
-            title="Como posso propagar suculentas?",
-            body="Já ouvi dizer que é fácil, mas não sei bem por onde começar. Alguém tem dicas?",
-        )
-        q2 = Question.objects.create(
-            user=user,
-            title="Porque é que as folhas do meu manjericão estão a ficar castanhas?",
-            body="Estavam bem na semana passada. Tenho regado com frequência.",
-        )
+        self.insert(Question, (self.question(i, user.id, user_ids) for i in range(options['questions'])))
+        self.insert(Answer, (
+            self.answer(question_id, j, i, user.id, user_ids)
+            for i, question_id in enumerate(Question.objects.order_by('id').values_list('id', flat=True).iterator())
+            for j in range(options['answers'])
+        ))
 
-        Answer.objects.create(
-            user=user,
-            question=q1,
-            body="Corta uma folha saudável e coloca-a sobre terra seca. Deve criar raízes em uma ou duas semanas."
-        )
+        # bulk_create doesn't send signals, fill the answer counters in one pass
+        recount_answers()
 
-        Answer.objects.create(
-            user=user,
-            question=q2,
-            body="Pode ser excesso de água ou algum fungo. Reduz a rega e verifica se há pragas."
-        )
+        # === Criar Encomendas ===
+        if options['orders']:
+            self.create_orders(options['orders'], product_ids)
 
         # === Criar Desafios ===
-        Challenge.objects.create(
-            text="Que parte da planta é responsável pela fotossíntese?",
-            correct_answer="Folhas",
-            date=date.today()
+        self.insert(Challenge, (
+            self.challenge(day, i)
+            for day in range(options['days'])
+            for i in range(options['challenges_per_day'])
+        ))
+
+        # Neither the clear nor bulk_create send signals: drop every cached page of the old data
+        cache.clear()
+        # ... and rebuild the search index
+        for kind in SEARCH_KINDS:
+            rebuild_index(kind, self.batch_size)
+
+        elapsed = time.perf_counter() - start
+        rows = sum(self.counts.values())
+        if self.verbosity > 1:
+            for name, count in self.counts.items():
+                self.stdout.write(f'{name}: {count}')
+        self.stdout.write(f'{rows} linhas em {elapsed:.1f}s ({rows / elapsed:.0f} linhas/s)')
+        self.stdout.write(self.style.SUCCESS('✅ Base de dados preenchida com sucesso!'))
+
+    def insert(self, model, objects):
+        name = model._meta.verbose_name_plural
+        for chunk in chunked(objects, self.batch_size):
+            model.objects.bulk_create(chunk)
+            self.counts[name] = self.counts.get(name, 0) + len(chunk)
+
+    def product(self, i, category_ids):
+        if i < len(PRODUCTS):
+            p = PRODUCTS[i]
+            return Product(name=p["name"], category_id=self.random.choice(category_ids), price=p["price"], description=p["desc"])
+        return Product(
+            name=f'Produto {i + 1}',
+            category_id=self.random.choice(category_ids),
+            price=round(self.random.uniform(1, 50), 2),
+            description=f'Produto de exemplo número {i + 1}.',
+        )
+
+    def question(self, i, user_id, user_ids):
+        if i < len(QUESTIONS):
+            return Question(user_id=user_id, title=QUESTIONS[i]["title"], body=QUESTIONS[i]["body"])
+        return Question(
+            user_id=self.random.choice(user_ids),
+            title=f'Pergunta {i + 1}',
+            body=f'Texto da pergunta de exemplo número {i + 1}.',
         )
 
-        Challenge.objects.create(
-            text="Como se chama uma planta que completa o ciclo de vida numa só estação?",
-            correct_answer="Anuais",
-            date=date.today()
+    def answer(self, question_id, j, i, user_id, user_ids):
+        if i < len(QUESTIONS) and j == 0:
+            return Answer(user_id=user_id, question_id=question_id, body=QUESTIONS[i]["answer"])
+        return Answer(
+            user_id=self.random.choice(user_ids),
+            question_id=question_id,
+            body=f'Resposta de exemplo número {j + 1}.',
         )
 
-        self.stdout.write(self.style.SUCCESS('✅ Base de dados preenchida com sucesso!'))
\ No newline at end of file
+    def challenge(self, day, i):
+        if i < len(CHALLENGES):
+            text, answer = CHALLENGES[i]["text"], CHALLENGES[i]["answer"]
+        else:
+            text, answer = f'Desafio de exemplo número {i + 1}', f'Resposta {i + 1}'
+        return Challenge(text=text, correct_answer=answer, normalized_answers=[normalize_answer(answer)], date=date.today() + timedelta(days=day))
+
+    # Completed orders with one to five lines and an address each
+    def create_orders(self, count, product_ids):
+        customer_ids = list(Customer.objects.values_list('id', flat=True))
+
+        for chunk in chunked(range(count), self.batch_size):
+            orders = [
+                Order(customer_id=self.random.choice(customer_ids), complete=True, transaction_id=f'{GENERATED_ORDER_PREFIX}{i}')
+                for i in chunk
+            ]
+            self.insert(Order, orders)
+            if orders[0].pk is None:
+                # Not every database returns the new ids from bulk_create, read them back
+                ids = dict(Order.objects.filter(transaction_id__in=[order.transaction_id for order in orders]).values_list('transaction_id', 'id'))
+                for order in orders:
+                    order.id = ids[order.transaction_id]
+
+            items = []
+            addresses = []
+            for order in orders:
+                for product_id in self.random.sample(product_ids, min(len(product_ids), self.random.randint(1, 5))):
+                    items.append(OrderItem(order_id=order.id, product_id=product_id, quantity=self.random.randint(1, 3)))
+                addresses.append(Address(order_id=order.id, customer_id=order.customer_id, street='Rua de Exemplo', city='Lisboa', postal_code='1000-001'))
+
+            self.insert(OrderItem, items)
+            self.insert(Address, addresses)
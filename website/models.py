@@ -1,15 +1,28 @@
 from django.db import models
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.contrib.auth.models import AbstractUser
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 import os
 from core.settings import BASE_DIR
-from storages.backends.azure_storage import AzureStorage
 
 
 
 class User(AbstractUser):
-    pass
+    # Name and email as loaded from the database, to tell whether the Customer needs updating
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_customer_fields = instance.customer_fields()
+        return instance
+
+    # Customer name and email for this user, None while a field is deferred
+    def customer_fields(self):
+        if {'first_name', 'last_name', 'email'} - self.__dict__.keys():
+            return None
+        return {'name': f'{self.first_name} {self.last_name}', 'email': self.email}
 
 class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True)
@@ -21,14 +34,28 @@ class Customer(models.Model):
     def create_customer(sender, instance, created, **kwargs):
         if created:
             # Create a Customer instance with User's first and last name
-            Customer.objects.create(user=instance, name=f'{instance.first_name} {instance.last_name}', email=instance.email)
+            Customer.objects.create(user=instance, **instance.customer_fields())
+            instance._loaded_customer_fields = instance.customer_fields()
 
-    # Signal to save the Customer when a User is saved
+    # Signal to copy the User's name and email to the Customer when they changed.
+    # Saves that only touch other fields, like the last_login update on every login, write nothing.
     @receiver(post_save, sender=User)
-    def save_customer(sender, instance, **kwargs):
+    def save_customer(sender, instance, created, update_fields=None, **kwargs):
+        if created or (update_fields is not None and not {'first_name', 'last_name', 'email'} & set(update_fields)):
+            return
+
+        fields = instance.customer_fields()
+        loaded = getattr(instance, '_loaded_customer_fields', None)
+        if fields is None or fields == loaded:
+            return
+
+        instance._loaded_customer_fields = fields
         if hasattr(instance, 'customer'):
-            instance.customer.save()
-        
+            changed = [name for name, value in fields.items() if loaded is None or loaded[name] != value]
+            for name in changed:
+                setattr(instance.customer, name, fields[name])
+            instance.customer.save(update_fields=changed)
+
     def __str__(self):
         return self.name
 
@@ -47,7 +74,9 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, default=1, null=True, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     description = models.TextField()
-    image = models.ImageField(upload_to='product/', storage=AzureStorage(), null=True, blank=True)
+    image = models.ImageField(upload_to='product/', null=True, blank=True)
+    # Resized copies of the image, written by images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return self.name
@@ -58,17 +87,41 @@ class Order(models.Model):
     complete = models.BooleanField(default=False, null=True, blank=False)
     transaction_id = models.CharField(max_length=150, null=True)
 
+    class Meta:
+        indexes = [
+            # Open cart lookup: Order(customer=?, complete=False)
+            models.Index(fields=['customer', 'complete'], name='order_customer_complete_idx'),
+        ]
+        constraints = [
+            # A customer has at most one open cart (partial index, ignored on MySQL)
+            models.UniqueConstraint(fields=['customer'], condition=Q(complete=False), name='unique_open_order_per_customer'),
+        ]
+
+    # Totals for the whole cart in a single aggregate query, memoized on the instance
+    @cached_property
+    def cart_summary(self):
+        summary = self.orderitem_set.aggregate(
+            total=Sum(F('product__price') * F('quantity'), output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+            items=Sum('quantity'),
+        )
+        return {'total': summary['total'] or 0, 'items': summary['items'] or 0}
+
+    # Drop the memoized totals after the cart lines change
+    def clear_cart_summary(self):
+        self.__dict__.pop('cart_summary', None)
+
     @property
     def get_cart_total(self):
-        orderitems = self.orderitem_set.all()
-        total = float(sum([item.get_total for item in orderitems]))
-        return total
+        return float(self.cart_summary['total'])
     
     @property
     def get_cart_items(self):
-        orderitems = self.orderitem_set.all()
-        total = sum([item.quantity for item in orderitems])
-        return total
+        return self.cart_summary['items']
+
+    # Cart lines with their products loaded in the same query
+    @property
+    def get_cart_lines(self):
+        return self.orderitem_set.select_related('product')
     
     def __str__(self):
         return str(self.id)
@@ -79,6 +132,11 @@ class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, blank=True, null=True)
     quantity = models.IntegerField(default=0, null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='unique_order_product'),
+        ]
+
     @property
     def get_total(self):
         total = self.product.price * self.quantity
@@ -88,6 +146,21 @@ class OrderItem(models.Model):
         return self.product.name + " x" + str(self.quantity)
     
 
+class OrderEvent(models.Model):
+    # Outbox of order messages, saved with the order and sent to the queue by drain_outbox
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True)
+    payload = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['sent_at', 'id'])]
+
+    def __str__(self):
+        return str(self.id)
+
+
 class Address(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='addresses', null=True, blank=True)
     order = models.ForeignKey(Order, on_delete=models.CASCADE, blank=True, null=True)
@@ -107,7 +180,20 @@ class Question(models.Model):
     title = models.CharField(max_length= 150)
     body = models.CharField(max_length= 500)
     created_at = models.DateTimeField(auto_now_add=True)
-    image = models.ImageField(upload_to='question/', storage=AzureStorage(), null=True, blank=True)
+    image = models.ImageField(upload_to='question/', null=True, blank=True)
+    # Resized copies of the image, written by images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Kept up to date by the Answer signals in forum.py, rebuilt by recount_answers
+    answer_count = models.IntegerField(default=0)
+    last_activity_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Forum listing, newest first with (created_at, id) keyset pagination
+            models.Index(fields=['-created_at', '-id'], name='question_created_idx'),
+            # Forum listing by latest activity
+            models.Index(fields=['-last_activity_at', '-id'], name='question_activity_idx'),
+        ]
 
     def __str__(self):
         return str(self.id)
@@ -119,15 +205,101 @@ class Answer(models.Model):
     body = models.CharField(max_length= 500)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Answers of a question in the order they were posted, with (created_at, id) keyset pagination
+            models.Index(fields=['question', 'created_at', 'id'], name='answer_question_created_idx'),
+        ]
+
     def __str__(self):
         return str(self.id)
 
 
+class SearchTerm(models.Model):
+    # Inverted index of products and questions, used by search.py on databases without FTS5
+    kind = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    term = models.CharField(max_length=100)
+    weight = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            # Documents holding a term
+            models.Index(fields=['kind', 'term', 'object_id'], name='searchterm_term_idx'),
+            # Terms of a document, replaced when it is saved
+            models.Index(fields=['kind', 'object_id'], name='searchterm_object_idx'),
+        ]
+
+    def __str__(self):
+        return self.term
+
+
 class Challenge(models.Model):
     text = models.CharField(max_length=500)
-    image = models.ImageField(upload_to='challenge/', storage=AzureStorage(), null=True)
+    image = models.ImageField(upload_to='challenge/', null=True)
+    # Resized copies of the image, written by images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     correct_answer = models.CharField(max_length=255)
-    date = models.DateField(null=True)
+    # Other answers that also count as correct, one per line
+    synonyms = models.TextField(blank=True)
+    # correct_answer and synonyms as compared by the grading, kept by challenges.py
+    normalized_answers = models.JSONField(default=list, blank=True, editable=False)
+    date = models.DateField(null=True, db_index=True)
+
+    def __str__(self):
+        return str(self.date)
+
+
+class DailyChallenge(models.Model):
+    # The challenge picked for each day, written by challenges.py so the pick never changes
+    date = models.DateField(unique=True)
+    challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE)
 
     def __str__(self):
         return str(self.date)
+
+
+class ChallengeAttempt(models.Model):
+    # One row per user and day: how many answers it took and whether one was right
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE)
+    date = models.DateField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    correct = models.BooleanField(default=False)
+    answered_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            # Also the index of a user's days, read by the streak
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_attempt_per_day'),
+        ]
+        indexes = [
+            # Who solved a day, fewest attempts and quickest first
+            models.Index(fields=['date', 'correct', 'attempts', 'answered_at'], name='attempt_ranking_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.date}'
+
+
+class LeaderboardEntry(models.Model):
+    # Totals of a user on the daily, weekly or all-time board, kept by leaderboards.py as days are solved
+    period = models.CharField(max_length=10)
+    period_start = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    solved = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    # When the last of those days was solved, the quickest ranks first among equal totals
+    solved_at = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'period_start', 'user'], name='unique_leaderboard_entry'),
+        ]
+        indexes = [
+            # Top of a board, read in ranking order
+            models.Index(fields=['period', 'period_start', '-solved', 'attempts', 'solved_at', 'user'], name='leaderboard_ranking_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.period} {self.period_start} {self.user}'
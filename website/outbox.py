@@ -0,0 +1,55 @@
+import logging
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import OrderEvent
+from .sendmessage import get_publisher
+
+logger = logging.getLogger(__name__)
+
+
+# Claim a batch of unsent events, send them and mark them as sent.
+# Rows locked by another drainer are skipped, so several drainers can run in parallel.
+# Each pass sends once without waiting between retries, so the rows are only locked for one round trip,
+# or ORDER_EVENTS_SEND_TIMEOUT seconds when the broker doesn't answer.
+# Events that failed ORDER_EVENTS_MAX_ATTEMPTS times are skipped, see retry_failed.
+def drain_batch(batch_size=50):
+    max_attempts = settings.ORDER_EVENTS_MAX_ATTEMPTS
+    with transaction.atomic():
+        events = list(
+            OrderEvent.objects.select_for_update(skip_locked=True)
+            .filter(sent_at__isnull=True, attempts__lt=max_attempts)
+            .order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0, 0
+
+        publisher = get_publisher()
+        sent, failed = [], []
+        try:
+            if publisher.send_batch([event.payload for event in events]):
+                sent = events
+            elif len(events) == 1:
+                failed = events
+            else:
+                # One at a time, so a single event the broker rejects doesn't hold back the rest
+                for event in events:
+                    (sent if publisher.send_batch([event.payload]) else failed).append(event)
+        except TimeoutError:
+            # The broker isn't answering, the rest waits for the next pass instead of timing out once per event
+            logger.exception('Order events not sent')
+            failed = [event for event in events if event not in sent]
+
+        OrderEvent.objects.filter(id__in=[event.id for event in sent]).update(sent_at=timezone.now(), attempts=F('attempts') + 1)
+        OrderEvent.objects.filter(id__in=[event.id for event in failed]).update(attempts=F('attempts') + 1)
+
+        given_up = [event.id for event in failed if event.attempts + 1 >= max_attempts]
+        if given_up:
+            logger.error('Gave up on order event(s) %s after %d attempts', given_up, max_attempts)
+        return len(sent), len(failed)
+
+
+# Let the events that were given up on be sent again, returns how many
+def retry_failed():
+    return OrderEvent.objects.filter(sent_at__isnull=True, attempts__gte=settings.ORDER_EVENTS_MAX_ATTEMPTS).update(attempts=0)
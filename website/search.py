@@ -0,0 +1,379 @@
+import re
+import threading
+import unicodedata
+from collections import Counter
+from contextlib import contextmanager
+from django.db import connection, connections
+from django.db.models import Count, F, QuerySet, Sum
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from .models import Product, Question, Answer, SearchTerm
+
+
+SEARCH_PAGE_SIZE = 20
+# A word in the title counts as much as this many words in the body
+TITLE_WEIGHT = 10
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+MAX_TERM_LENGTH = 100
+
+# Accent-folded, so "é" and "e" are both dropped
+STOPWORDS = frozenset('''
+    a ao aos as com como da das de do dos e ela ele em entre essa esse esta este eu foi ha isso
+    ja lhe mais mas me meu minha na nas nao no nos o os ou para pela pelas pelo pelos por qual
+    quando que se sem ser seu sua tem um uma umas uns voce
+'''.split())
+
+# Portuguese plural endings that don't just drop the "s"
+PLURAL_SUFFIXES = [
+    ('oes', 'ao'),
+    ('aes', 'ao'),
+    ('ais', 'al'),
+    ('eis', 'el'),
+    ('ois', 'ol'),
+    ('ns', 'm'),
+]
+
+
+# Lower case without accents, "Árvore" becomes "arvore"
+def fold(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in text if not unicodedata.combining(char)).lower()
+
+
+# Light stemming so singular and plural meet, "flores" and "flor" are both "flor"
+def stem(token):
+    if len(token) <= 3:
+        return token
+    for suffix, replacement in PLURAL_SUFFIXES:
+        if token.endswith(suffix) and len(token) > len(suffix) + 1:
+            return token[:-len(suffix)] + replacement
+    if token.endswith('s'):
+        token = token[:-1]
+    if token.endswith('e') and len(token) > 3:
+        token = token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [stem(token)[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(fold(text)) if token not in STOPWORDS]
+
+
+# Terms of a search box query, each one only once
+def query_terms(query):
+    return list(dict.fromkeys(tokenize(query)))
+
+
+# Text indexed for each kind of document, as (id, title, body)
+def product_document(product):
+    return product.pk, product.name, product.description
+
+
+def question_document(question, answers=None):
+    if answers is None:
+        answers = Answer.objects.filter(question_id=question.pk).values_list('body', flat=True)
+    return question.pk, question.title, ' '.join([question.body, *answers])
+
+
+class FtsIndex:
+    # SQLite FTS5 table per kind, the rowid is the id of the product or question.
+    # Text goes in already tokenized, so both indexes match the same words.
+    tables = {
+        'products': 'website_search_product',
+        'questions': 'website_search_question',
+    }
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_tables(self):
+        with self.connection.cursor() as cursor:
+            for table in self.tables.values():
+                cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(title, body)')
+
+    def index(self, kind, documents):
+        if not documents:
+            return
+        table = self.tables[kind]
+        with self.connection.cursor() as cursor:
+            self.delete(cursor, table, [pk for pk, title, body in documents])
+            cursor.executemany(
+                f'INSERT INTO {table} (rowid, title, body) VALUES (%s, %s, %s)',
+                [(pk, ' '.join(tokenize(title)), ' '.join(tokenize(body))) for pk, title, body in documents],
+            )
+
+    def remove(self, kind, ids):
+        with self.connection.cursor() as cursor:
+            self.delete(cursor, self.tables[kind], ids)
+
+    # Add text to the body of an indexed document, without rewriting the rest of it
+    def add_text(self, kind, pk, text):
+        tokens = ' '.join(tokenize(text))
+        if tokens:
+            table = self.tables[kind]
+            with self.connection.cursor() as cursor:
+                cursor.execute(f"UPDATE {table} SET body = trim(body || ' ' || %s) WHERE rowid = %s", [tokens, pk])
+
+    # Take text added by add_text out of the body again. The index only counts words, so cutting
+    # the first place the same words appear in a row gives the same document.
+    def remove_text(self, kind, pk, text):
+        tokens = ' '.join(tokenize(text))
+        if tokens:
+            table = self.tables[kind]
+            padded = "(' ' || body || ' ')"
+            position = f"instr({padded}, ' ' || %s || ' ')"
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    f'UPDATE {table} SET body = trim(substr({padded}, 1, {position}) || substr({padded}, {position} + length(%s) + 2)) '
+                    f'WHERE rowid = %s AND {position} > 0',
+                    [tokens, tokens, tokens, pk, tokens],
+                )
+
+    def delete(self, cursor, table, ids):
+        cursor.execute(f'DELETE FROM {table} WHERE rowid IN ({", ".join(["%s"] * len(ids))})', ids)
+
+    def clear(self, kind):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.tables[kind]}')
+
+    def match(self, terms):
+        # Terms only hold [a-z0-9], quoting them keeps FTS5 from reading them as operators
+        return ' '.join(f'"{term}"' for term in terms)
+
+    def count(self, kind, terms):
+        table = self.tables[kind]
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {table} WHERE {table} MATCH %s', [self.match(terms)])
+            return cursor.fetchone()[0]
+
+    def search(self, kind, terms, offset, limit):
+        table = self.tables[kind]
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {table} WHERE {table} MATCH %s '
+                f'ORDER BY bm25({table}, {TITLE_WEIGHT}, 1), rowid DESC LIMIT %s OFFSET %s',
+                [self.match(terms), limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class TermIndex:
+    # Inverted index in the SearchTerm table, one row per (document, term), for databases without FTS5
+    def create_tables(self):
+        pass
+
+    def index(self, kind, documents):
+        if not documents:
+            return
+        self.remove(kind, [pk for pk, title, body in documents])
+
+        terms = []
+        for pk, title, body in documents:
+            weights = Counter()
+            for term in tokenize(title):
+                weights[term] += TITLE_WEIGHT
+            for term in tokenize(body):
+                weights[term] += 1
+            terms.extend(SearchTerm(kind=kind, object_id=pk, term=term, weight=weight) for term, weight in weights.items())
+        SearchTerm.objects.bulk_create(terms)
+
+    def remove(self, kind, ids):
+        SearchTerm.objects.filter(kind=kind, object_id__in=ids).delete()
+
+    # Add the weights of the text's terms to the document, one UPDATE per distinct count
+    def add_text(self, kind, pk, text):
+        weights = Counter(tokenize(text))
+        terms = SearchTerm.objects.filter(kind=kind, object_id=pk)
+        for count, group in self.by_count(weights).items():
+            terms.filter(term__in=group).update(weight=F('weight') + count)
+        existing = set(terms.filter(term__in=weights).values_list('term', flat=True))
+        SearchTerm.objects.bulk_create(
+            SearchTerm(kind=kind, object_id=pk, term=term, weight=weight) for term, weight in weights.items() if term not in existing
+        )
+
+    def remove_text(self, kind, pk, text):
+        weights = Counter(tokenize(text))
+        terms = SearchTerm.objects.filter(kind=kind, object_id=pk)
+        for count, group in self.by_count(weights).items():
+            terms.filter(term__in=group).update(weight=F('weight') - count)
+        if weights:
+            terms.filter(term__in=weights, weight__lte=0).delete()
+
+    def by_count(self, weights):
+        groups = {}
+        for term, count in weights.items():
+            groups.setdefault(count, []).append(term)
+        return groups
+
+    def clear(self, kind):
+        SearchTerm.objects.filter(kind=kind).delete()
+
+    # Documents holding every term, best weighted first
+    def matches(self, kind, terms):
+        return (
+            SearchTerm.objects.filter(kind=kind, term__in=terms)
+            .values('object_id')
+            .annotate(matched=Count('term', distinct=True), score=Sum('weight'))
+            .filter(matched=len(terms))
+        )
+
+    def count(self, kind, terms):
+        return self.matches(kind, terms).count()
+
+    def search(self, kind, terms, offset, limit):
+        matches = self.matches(kind, terms).order_by('-score', '-object_id')
+        return [match['object_id'] for match in matches[offset:offset + limit]]
+
+
+_fts5 = {}
+
+
+def fts5_available(connection):
+    if connection.alias not in _fts5:
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            _fts5[connection.alias] = any(row[0] == 'ENABLE_FTS5' for row in cursor.fetchall())
+    return _fts5[connection.alias]
+
+
+# FTS5 on SQLite builds that have it, the SearchTerm table everywhere else
+def get_index(using=None):
+    db = connection if using is None else connections[using]
+    if db.vendor == 'sqlite' and fts5_available(db):
+        return FtsIndex(db)
+    return TermIndex()
+
+
+# Connected to post_migrate in apps.py, FTS5 tables aren't models so migrate doesn't create them
+def create_search_tables(using='default', **kwargs):
+    get_index(using).create_tables()
+
+
+SEARCH_KINDS = {
+    'products': Product.objects.all(),
+    'questions': Question.objects.select_related('user'),
+}
+
+
+class SearchResults:
+    # Ranked results Paginator can slice, only the ids of the requested page are read from the index
+    def __init__(self, kind, query, index=None):
+        self.kind = kind
+        self.terms = query_terms(query)
+        self.index = index or get_index()
+
+    def count(self):
+        if not self.terms:
+            return 0
+        return self.index.count(self.kind, self.terms)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        start, stop = key.start or 0, key.stop
+        if not self.terms or stop <= start:
+            return []
+        ids = self.index.search(self.kind, self.terms, start, stop - start)
+        objects = SEARCH_KINDS[self.kind].in_bulk(ids)
+        return [objects[pk] for pk in ids if pk in objects]
+
+
+# Rebuild a whole kind from the database, chunk by chunk, for rows written without signals
+def rebuild_index(kind, batch_size=1000, index=None):
+    index = index or get_index()
+    index.clear(kind)
+
+    model = Product if kind == 'products' else Question
+    indexed = 0
+    last_id = 0
+    while True:
+        rows = list(model.objects.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not rows:
+            return indexed
+
+        if kind == 'products':
+            documents = [product_document(product) for product in rows]
+        else:
+            answers = {}
+            for question_id, body in Answer.objects.filter(question__in=rows).order_by('id').values_list('question_id', 'body'):
+                answers.setdefault(question_id, []).append(body)
+            documents = [question_document(question, answers.get(question.pk, [])) for question in rows]
+
+        index.index(kind, documents)
+        indexed += len(rows)
+        last_id = rows[-1].id
+
+
+_paused = threading.local()
+
+
+# Turn the receivers below off in this thread, for bulk changes followed by rebuild_index
+@contextmanager
+def indexing_paused():
+    previous = getattr(_paused, 'value', False)
+    _paused.value = True
+    try:
+        yield
+    finally:
+        _paused.value = previous
+
+
+def indexing():
+    return not getattr(_paused, 'value', False)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    if indexing():
+        get_index().index('products', [product_document(instance)])
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    if indexing():
+        get_index().remove('products', [instance.pk])
+
+
+@receiver(post_save, sender=Question)
+def question_saved(sender, instance, **kwargs):
+    if indexing():
+        get_index().index('questions', [question_document(instance)])
+
+
+@receiver(post_delete, sender=Question)
+def question_deleted(sender, instance, **kwargs):
+    if indexing():
+        get_index().remove('questions', [instance.pk])
+
+
+# Body the answer had before the save, so answer_saved can take it out of the question's document
+@receiver(pre_save, sender=Answer)
+def remember_answer(sender, instance, raw=False, **kwargs):
+    instance._indexed_answer = None
+    if instance.pk and not raw and indexing():
+        instance._indexed_answer = Answer.objects.filter(pk=instance.pk).values_list('question_id', 'body').first()
+
+
+# Answers are part of their question's document, only their own words are added or taken out
+@receiver(post_save, sender=Answer)
+def answer_saved(sender, instance, created, **kwargs):
+    if not indexing() or not instance.question_id:
+        return
+    index = get_index()
+    previous = getattr(instance, '_indexed_answer', None)
+    if previous == (instance.question_id, instance.body):
+        return
+    if previous and previous[0]:
+        index.remove_text('questions', previous[0], previous[1])
+    index.add_text('questions', instance.question_id, instance.body)
+
+
+@receiver(post_delete, sender=Answer)
+def answer_deleted(sender, instance, origin=None, **kwargs):
+    if not indexing() or not instance.question_id:
+        return
+    # Deleting the question deletes its answers first, question_deleted drops the whole document
+    if isinstance(origin, Question) or (isinstance(origin, QuerySet) and origin.model is Question):
+        return
+    get_index().remove_text('questions', instance.question_id, instance.body)
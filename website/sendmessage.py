@@ -1,24 +1,156 @@
 import asyncio
+import atexit
+import concurrent.futures
+import logging
 import os
+import threading
 from dotenv import load_dotenv
-from azure.servicebus.aio import ServiceBusClient
-from azure.servicebus import ServiceBusMessage
+from django.conf import settings
+from django.utils.module_loading import import_string
 
 load_dotenv()
 
 QUEUE_NAME = os.environ.get("DJANGO_QUEUE")
 connection_string = os.environ.get("CONNECTION_STRING")
 
+logger = logging.getLogger(__name__)
 
-async def send_single_message(order_json):
-    # create a Service Bus client using the credential
-    async with ServiceBusClient.from_connection_string(connection_string) as servicebus_client:
-        # get a Queue Sender object to send messages to the queue
-        sender = servicebus_client.get_queue_sender(queue_name=QUEUE_NAME)
-        async with sender:
-    # Create a Service Bus message and send it to the queue
-            message = ServiceBusMessage(order_json)
-            await sender.send_messages(message)
-            print("Sent a single message")
 
+class ServiceBusBackend:
+    # Keeps one client and sender open and reuses them for every batch
+    def __init__(self):
+        self.client = None
+        self.sender = None
 
+    async def connect(self):
+        if self.sender is None:
+            from azure.servicebus.aio import ServiceBusClient
+            self.client = ServiceBusClient.from_connection_string(connection_string)
+            self.sender = self.client.get_queue_sender(queue_name=QUEUE_NAME)
+            await self.sender.__aenter__()
+
+    async def send(self, messages):
+        # Imported here, the SDK takes a while to load and only the process sending messages needs it
+        from azure.servicebus import ServiceBusMessage
+
+        await self.connect()
+        try:
+            batch = await self.sender.create_message_batch()
+            for message in messages:
+                try:
+                    batch.add_message(ServiceBusMessage(message))
+                except ValueError:
+                    # Batch is full, send it and start a new one
+                    await self.sender.send_messages(batch)
+                    batch = await self.sender.create_message_batch()
+                    batch.add_message(ServiceBusMessage(message))
+            await self.sender.send_messages(batch)
+        except Exception:
+            # Reconnect on the next attempt in case the connection was dropped
+            await self.close()
+            raise
+
+    async def close(self):
+        sender, client = self.sender, self.client
+        self.sender = self.client = None
+        if sender is not None:
+            await sender.close()
+        if client is not None:
+            await client.close()
+
+
+class MemoryBackend:
+    # Stand-in that keeps the messages in memory, for tests and benchmarks
+    def __init__(self):
+        self.messages = []
+        self.batches = 0
+
+    async def send(self, messages):
+        self.messages.extend(messages)
+        self.batches += 1
+
+    async def close(self):
+        pass
+
+
+class FileBackend:
+    # Stand-in that appends one message per line to a local file
+    def __init__(self, path=None):
+        self.path = path or settings.ORDER_EVENTS_FILE
+
+    async def send(self, messages):
+        with open(self.path, 'a', encoding='utf-8') as file:
+            for message in messages:
+                file.write(message + '\n')
+
+    async def close(self):
+        pass
+
+
+class OrderPublisher:
+    # Sends batches on a background event loop, so the backend keeps one connection open between batches.
+    # There are no retries here: an event that fails stays in the outbox and the next drain_outbox pass tries it again.
+    def __init__(self, backend, timeout=None):
+        self.backend = backend
+        self.timeout = timeout
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name='order-publisher', daemon=True)
+            self.thread.start()
+
+    async def send(self, messages):
+        try:
+            await self.backend.send(messages)
+            return True
+        except Exception:
+            logger.exception('Failed to send %d order message(s)', len(messages))
+            return False
+
+    # Send a batch once on the publisher's connection, returns False if the broker didn't take it.
+    # Raises TimeoutError when it didn't answer within the timeout.
+    def send_batch(self, messages):
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self.send(messages), self.loop)
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f'Sending {len(messages)} order message(s) timed out after {self.timeout} seconds') from None
+
+    def close(self, timeout=5):
+        if self.thread is None or not self.thread.is_alive():
+            return
+        asyncio.run_coroutine_threadsafe(self.backend.close(), self.loop).result(timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        self.loop.close()
+
+
+_publisher = None
+_publisher_backend = None
+_publisher_lock = threading.Lock()
+
+
+# Process-wide publisher for the ORDER_EVENTS_BACKEND setting
+def get_publisher():
+    global _publisher, _publisher_backend
+    with _publisher_lock:
+        if _publisher is None or _publisher_backend != settings.ORDER_EVENTS_BACKEND:
+            if _publisher is not None:
+                _publisher.close()
+            _publisher = OrderPublisher(import_string(settings.ORDER_EVENTS_BACKEND)(), settings.ORDER_EVENTS_SEND_TIMEOUT)
+            _publisher_backend = settings.ORDER_EVENTS_BACKEND
+        return _publisher
+
+
+@atexit.register
+def close_publisher():
+    if _publisher is not None:
+        _publisher.close()
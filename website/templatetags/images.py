@@ -0,0 +1,38 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+
+# Variants of an image field, empty until images.py has generated them for the current file
+def variants_of(image):
+    variants = getattr(image.instance, 'image_variants', None) or {}
+    return variants if variants.get('source') == image.name else {}
+
+
+@register.simple_tag
+def image_srcset(image, format='jpeg'):
+    if not image:
+        return ''
+    variants = variants_of(image).get(format, {})
+    return ', '.join(f'{image.storage.url(name)} {width}w' for width, name in variants.items())
+
+
+# <picture> with WebP and JPEG srcsets, or a plain <img> of the original while there are no variants.
+# Extra keyword arguments become attributes of the <img>, e.g. {% responsive_image product.image sizes="17rem" class="card-img-top" %}
+@register.simple_tag
+def responsive_image(image, sizes='100vw', **attrs):
+    if not image:
+        return ''
+
+    attributes = format_html_join('', ' {}="{}"', attrs.items())
+    variants = variants_of(image)
+    if not variants:
+        return format_html('<img src="{}" loading="lazy"{}>', image.url, attributes)
+
+    jpeg = variants['jpeg']
+    largest = jpeg[max(jpeg, key=int)]
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}"><img src="{}" srcset="{}" sizes="{}" loading="lazy"{}></picture>',
+        image_srcset(image, 'webp'), sizes, image.storage.url(largest), image_srcset(image, 'jpeg'), sizes, attributes,
+    )
@@ -1,6 +1,44 @@
-from django.test import TestCase
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.conf import settings
+from django.utils import timezone
+from django.db.models.signals import post_delete
+from django.db import IntegrityError, connection
+from django.urls import reverse
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from PIL import Image
+from io import BytesIO, StringIO
+from decimal import Decimal
+from unittest import mock
+import asyncio
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 from .models import *
+from .utils import cookieCart, orderMessage, mergeCookieCart
+from .management.commands.explain_queries import HOT_QUERIES
+from .forum import forum_page, answers_page, render_answers, ANSWER_PAGE_SIZE
+from .images import VariantWorker, process_image
+from .challenges import daily_challenge, pick_challenge, seconds_until_end_of, normalize_answer, is_correct, grade_answer, current_streak
+from .leaderboards import add_to_entry, leaderboard, period_start, rebuild_leaderboards
+from .caching import TieredCache
+from .search import SearchResults, FtsIndex, TermIndex, indexing_paused, rebuild_index, tokenize
+from .benchmarks import seed_dataset, run_benchmarks, compare_to_baseline
+from .sendmessage import OrderPublisher, MemoryBackend, FileBackend, get_publisher
+from .outbox import drain_batch
 
 
 class UserModelTestCase(TestCase):
@@ -14,6 +52,31 @@ class UserModelTestCase(TestCase):
         user = self.client.login(username='testuser', password='testpassword')
         self.assertTrue(user)
 
+    def test_customer_follows_user_changes(self):
+        #Test a changed name or email is copied to the customer.
+        user = User.objects.get(pk=self.user.pk)
+        user.first_name = 'Ana'
+        user.email = 'ana@example.com'
+        user.save()
+        customer = Customer.objects.get(user=user)
+        self.assertEqual((customer.name, customer.email), ('Ana ', 'ana@example.com'))
+
+    def test_unchanged_user_doesnt_write_customer(self):
+        #Test saving a user without name or email changes runs no customer query.
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            user.save(update_fields=['last_login'])
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertFalse([query for query in queries if 'website_customer' in query['sql']])
+
+    def test_login_doesnt_write_customer(self):
+        #Test logging in through the login page doesn't touch the customer.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('login'), {'username': 'testuser', 'password': 'testpassword'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertFalse([query for query in queries if 'website_customer' in query['sql']])
+
 class CategoryModelTestCase(TestCase):
     def setUp(self):
         # Create some test categories
@@ -251,4 +314,1641 @@ class ChallengeModelTestCase(TestCase):
 
     def test_challenge_date(self):
         #Test the challenge date field.
-        self.assertEqual(self.challenge.date, '2023-10-14')
\ No newline at end of file
+        self.assertEqual(self.challenge.date, '2023-10-14')
+
+class OrderCartSummaryTestCase(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(name='testname', email='testemail')
+        self.category = Category.objects.create(name='Test Category')
+        self.order = Order.objects.create(customer=self.customer, complete=False)
+
+    def add_lines(self, count):
+        start = Product.objects.count()
+        for i in range(start, start + count):
+            product = Product.objects.create(name=f'Product {i}', category=self.category, price=2.50, description='Test')
+            OrderItem.objects.create(product=product, order=self.order, quantity=2)
+
+    def read_cart(self):
+        order = Order.objects.get(pk=self.order.pk)
+        with self.assertNumQueries(2):
+            total = order.get_cart_total
+            items = order.get_cart_items
+            # Reading the totals again must hit the memoized summary
+            self.assertEqual(order.get_cart_total, total)
+            line_totals = [line.get_total for line in order.get_cart_lines]
+        return total, items, line_totals
+
+    def test_cart_summary_values(self):
+        #Test the totals are computed in the database.
+        self.add_lines(3)
+        total, items, line_totals = self.read_cart()
+        self.assertEqual(total, 15.0)
+        self.assertEqual(items, 6)
+        self.assertEqual(len(line_totals), 3)
+
+    def test_empty_cart_summary(self):
+        #Test an empty cart has zero totals.
+        total, items, line_totals = self.read_cart()
+        self.assertEqual(total, 0)
+        self.assertEqual(items, 0)
+
+    def test_cart_query_count_is_fixed(self):
+        #Test the number of queries doesn't grow with the number of lines.
+        self.add_lines(1)
+        self.read_cart()
+        OrderItem.objects.all().delete()
+        self.add_lines(40)
+        total, items, line_totals = self.read_cart()
+        self.assertEqual(len(line_totals), 40)
+
+    def test_clear_cart_summary(self):
+        #Test the memoized summary can be refreshed after a change.
+        self.add_lines(1)
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual(order.get_cart_items, 2)
+        OrderItem.objects.filter(order=order).update(quantity=5)
+        self.assertEqual(order.get_cart_items, 2)
+        order.clear_cart_summary()
+        self.assertEqual(order.get_cart_items, 5)
+
+
+class CookieCartTestCase(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Test Category')
+        self.products = [
+            Product.objects.create(name=f'Product {i}', category=self.category, price=1.50, description='Test')
+            for i in range(200)
+        ]
+
+    def cookie_request(self, cart):
+        request = RequestFactory().get('/store/')
+        request.COOKIES['cart'] = cart if isinstance(cart, str) else json.dumps(cart)
+        return request
+
+    def test_cookie_cart_totals(self):
+        #Test the guest cart totals are computed from the cookie.
+        cart = {str(self.products[0].id): {'quantity': 2}, str(self.products[1].id): {'quantity': 1}}
+        data = cookieCart(self.cookie_request(cart))
+        self.assertEqual(data['cartItems'], 3)
+        self.assertEqual(data['order']['get_cart_total'], Decimal('4.50'))
+        self.assertEqual(len(data['items']), 2)
+
+    def test_malformed_entries_are_dropped(self):
+        #Test bad ids, quantities and removed products are ignored.
+        cart = {
+            str(self.products[0].id): {'quantity': 1},
+            'abc': {'quantity': 1},
+            str(self.products[1].id): {'quantity': 'many'},
+            str(self.products[2].id): [],
+            str(self.products[3].id): {'quantity': 0},
+            '999999': {'quantity': 1},
+        }
+        data = cookieCart(self.cookie_request(cart))
+        self.assertEqual(data['cartItems'], 1)
+        self.assertEqual([item['product']['id'] for item in data['items']], [self.products[0].id])
+
+    def test_invalid_cookie(self):
+        #Test a cookie that isn't a JSON object gives an empty cart.
+        for value in ['not json', '[1, 2]', 'null']:
+            data = cookieCart(self.cookie_request(value))
+            self.assertEqual(data['cartItems'], 0)
+            self.assertEqual(data['items'], [])
+
+    def test_single_query_for_any_cart_size(self):
+        #Test the products are resolved with one query from 1 to 200 lines.
+        for size in [1, 50, 200]:
+            cart = {str(product.id): {'quantity': 1} for product in self.products[:size]}
+            request = self.cookie_request(cart)
+            with self.assertNumQueries(1):
+                data = cookieCart(request)
+            self.assertEqual(data['cartItems'], size)
+
+
+class StoreCatalogueTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Test Category')
+        self.other_category = Category.objects.create(name='Other Category')
+        for i in range(25):
+            Product.objects.create(name=f'Product {i}', category=self.category, price=1, description='Test')
+        Product.objects.create(name='Other Product', category=self.other_category, price=1, description='Test')
+
+    def test_store_pagination(self):
+        #Test the store shows one page of products at a time.
+        response = self.client.get(reverse('store'), {'limit': 10, 'page': 3})
+        self.assertContains(response, 'Product 20')
+        self.assertContains(response, 'Other Product')
+        self.assertNotContains(response, 'Product 19<')
+        self.assertContains(response, '3 / 3')
+
+    def test_store_category_filter(self):
+        #Test the store filters products by category.
+        response = self.client.get(reverse('store'), {'category': self.other_category.id})
+        self.assertContains(response, 'Other Product')
+        self.assertNotContains(response, 'Product 0<')
+
+    def test_invalid_query_parameters(self):
+        #Test bad query parameters fall back to the defaults.
+        response = self.client.get(reverse('store'), {'category': 'abc', 'page': 'x', 'limit': '-5'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Product 0<')
+
+    def test_out_of_range_shares_cached_page(self):
+        #Test pages past the end and unknown categories are served the cached real page.
+        last = self.client.get(reverse('store'), {'limit': 10, 'page': 3})
+        first = self.client.get(reverse('store'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('store'), {'limit': 10, 'page': 999999})
+            self.assertEqual(response['ETag'], last['ETag'])
+            response = self.client.get(reverse('store'), {'category': 123456})
+            self.assertEqual(response['ETag'], first['ETag'])
+        self.assertContains(response, 'Product 0<')
+
+    def test_catalogue_is_cached(self):
+        #Test a second request doesn't query the products again.
+        self.client.get(reverse('store'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('store'))
+        self.assertContains(response, 'Product 0<')
+
+    def test_cache_invalidated_on_product_change(self):
+        #Test saving or deleting a product refreshes the cached catalogue.
+        self.client.get(reverse('store'))
+        product = Product.objects.get(name='Product 0')
+        product.name = 'Renamed Product'
+        product.save()
+        self.assertContains(self.client.get(reverse('store')), 'Renamed Product')
+        product.delete()
+        self.assertNotContains(self.client.get(reverse('store')), 'Renamed Product')
+
+    def test_cache_invalidated_on_category_change(self):
+        #Test saving a category refreshes the cached catalogue.
+        self.client.get(reverse('store'))
+        Category.objects.create(name='New Category')
+        self.assertContains(self.client.get(reverse('store')), 'New Category')
+
+    def test_not_modified(self):
+        #Test a matching ETag gets a 304 response.
+        response = self.client.get(reverse('store'))
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+        response = self.client.get(reverse('store'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(reverse('store'), {'page': 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_cart_badge_outside_cache(self):
+        #Test the cart badge and ETag follow the cart while the catalogue is cached.
+        response = self.client.get(reverse('store'))
+        etag = response['ETag']
+        product = Product.objects.get(name='Product 0')
+        self.client.cookies['cart'] = json.dumps({str(product.id): {'quantity': 3}})
+        response = self.client.get(reverse('store'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<p id="cart-total">3</p>')
+
+    def test_if_modified_since_ignored(self):
+        #Test a date-only revalidation never gets a 304 that would keep an old cart badge.
+        response = self.client.get(reverse('store'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        response = self.client.get(reverse('store'), HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+
+class FlakyBackend(MemoryBackend):
+    def __init__(self, failures=1):
+        super().__init__()
+        self.failures = failures
+        self.attempts = 0
+
+    async def send(self, messages):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectionError('Broker unavailable')
+        await super().send(messages)
+
+
+class PoisonBackend(MemoryBackend):
+    # Rejects every batch holding a "poison" message
+    async def send(self, messages):
+        if 'poison' in messages:
+            raise ValueError('Message rejected')
+        await super().send(messages)
+
+
+class HangingBackend(MemoryBackend):
+    # A broker that never answers
+    async def send(self, messages):
+        await asyncio.sleep(60)
+
+
+class OrderPublisherTestCase(TestCase):
+    def make_publisher(self, backend):
+        publisher = OrderPublisher(backend)
+        self.addCleanup(publisher.close)
+        return publisher
+
+    def test_send_batch(self):
+        #Test a batch is sent in one call on the publisher's loop.
+        backend = MemoryBackend()
+        publisher = self.make_publisher(backend)
+        self.assertTrue(publisher.send_batch(['1', '2']))
+        self.assertTrue(publisher.send_batch(['3']))
+        self.assertEqual(backend.messages, ['1', '2', '3'])
+        self.assertEqual(backend.batches, 2)
+
+    def test_failed_send_isnt_retried(self):
+        #Test a failed batch is reported after one attempt, without waiting to retry.
+        backend = FlakyBackend(failures=1)
+        publisher = self.make_publisher(backend)
+        with self.assertLogs('website.sendmessage', level='ERROR'):
+            self.assertFalse(publisher.send_batch(['order']))
+        self.assertEqual(backend.attempts, 1)
+        self.assertTrue(publisher.send_batch(['order']))
+        self.assertEqual(backend.messages, ['order'])
+
+    def test_send_times_out(self):
+        #Test a broker that doesn't answer makes the send fail after the timeout.
+        publisher = OrderPublisher(HangingBackend(), timeout=0.1)
+        self.addCleanup(publisher.close)
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            publisher.send_batch(['order'])
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_file_backend(self):
+        #Test the file backend writes one message per line.
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'events.jsonl')
+            publisher = self.make_publisher(FileBackend(path))
+            self.assertTrue(publisher.send_batch(['{"order_id": 1}', '{"order_id": 2}']))
+            with open(path) as file:
+                self.assertEqual(file.read().splitlines(), ['{"order_id": 1}', '{"order_id": 2}'])
+
+
+class FailingBackend(MemoryBackend):
+    async def send(self, messages):
+        raise ConnectionError('Broker unavailable')
+
+
+@override_settings(ORDER_EVENTS_BACKEND='website.sendmessage.MemoryBackend')
+class OrderOutboxTestCase(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Test Category')
+        self.product = Product.objects.create(name='Test Product', category=category, price=5, description='Test')
+
+    def checkout(self, total='10.00', cart=None, shipping=None):
+        cart = cart or {self.product.id: 2}
+        self.client.cookies['cart'] = json.dumps({str(product_id): {'quantity': quantity} for product_id, quantity in cart.items()})
+        return self.client.post(reverse('process_order'), json.dumps({
+            'form': {'name': 'Guest', 'email': 'guest@example.com', 'total': total},
+            'shipping': shipping or {'street': 'Rua 1', 'city': 'Lisboa', 'postal_code': '1000-001'},
+        }), content_type='application/json')
+
+    def test_checkout_writes_outbox_event(self):
+        #Test a completed checkout saves the order message in the outbox.
+        response = self.checkout()
+        self.assertEqual(response.status_code, 200)
+        event = OrderEvent.objects.get()
+        self.assertTrue(event.order.complete)
+        self.assertIsNone(event.sent_at)
+        message = json.loads(event.payload)
+        self.assertEqual(message['customer_email'], 'guest@example.com')
+        self.assertEqual(message['order_items'], [{'product_name': 'Test Product', 'quantity': 2}])
+
+    def test_guest_checkout_queries_dont_grow_with_cart(self):
+        #Test a guest checkout runs the same number of queries for one product or many.
+        self.checkout()
+        with CaptureQueriesContext(connection) as small:
+            self.checkout()
+        category = self.product.category
+        products = [Product.objects.create(name=f'Product {i}', category=category, price=1, description='Test') for i in range(5)]
+        cart = {product.id: 1 for product in products}
+        with CaptureQueriesContext(connection) as large:
+            self.checkout(total='5.00', cart=cart)
+        self.assertEqual(len(small), len(large))
+        order = Order.objects.get(orderitem__product=products[0])
+        self.assertTrue(order.complete)
+        self.assertEqual(order.get_cart_items, 5)
+
+    def test_logged_in_checkout_queries_dont_grow_with_cart(self):
+        #Test a logged in checkout runs the same number of queries for one product or many.
+        user = User.objects.create(username='buyer')
+        self.client.force_login(user)
+        category = self.product.category
+        counts = []
+        for size in (1, 5):
+            order = Order.objects.create(customer=user.customer)
+            for i in range(size):
+                product = Product.objects.create(name=f'Product {size} {i}', category=category, price=1, description='Test')
+                OrderItem.objects.create(order=order, product=product, quantity=1)
+            with CaptureQueriesContext(connection) as queries:
+                self.checkout(total=f'{size}.00')
+            counts.append(len(queries))
+            self.assertTrue(Order.objects.get(pk=order.pk).complete)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_order_message_uses_loaded_objects(self):
+        #Test the confirmation message is built without queries from the checkout's objects.
+        customer = Customer.objects.create(name='Guest', email='guest@example.com')
+        order = Order.objects.create(customer=customer, complete=True)
+        address = Address.objects.create(customer=customer, order=order, street='Rua 1', city='Lisboa', postal_code='1000-001')
+        Address.objects.create(customer=customer, order=order, street='Rua 2', city='Porto', postal_code='4000-001')
+        OrderItem.objects.create(order=order, product=self.product, quantity=2)
+        lines = list(order.get_cart_lines)
+
+        with self.assertNumQueries(0):
+            message = orderMessage(order, customer, address, lines)
+        self.assertEqual(message['address']['street'], 'Rua 1')
+        self.assertEqual(message['order_items'], [{'product_name': 'Test Product', 'quantity': 2}])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(orderMessage(order, customer, address), message)
+
+    def test_guest_checkout_keeps_unfinished_order(self):
+        #Test a new guest checkout leaves an unfinished one with the same email as it was.
+        self.checkout(total='1.00')
+        self.checkout(total='1.00', cart={self.product.id: 3, 999: 1})
+        first, second = Order.objects.order_by('id')
+        self.assertEqual([(item.product, item.quantity) for item in first.orderitem_set.all()], [(self.product, 2)])
+        self.assertEqual([(item.product, item.quantity) for item in second.orderitem_set.all()], [(self.product, 3)])
+        self.assertNotEqual(first.customer, second.customer)
+
+    def test_guest_customer_reused(self):
+        #Test finished guest checkouts with the same email share one customer.
+        self.checkout()
+        self.checkout()
+        self.assertEqual(Customer.objects.count(), 1)
+        self.assertEqual(Order.objects.filter(complete=True).count(), 2)
+
+    def test_guest_checkout_with_user_email(self):
+        #Test a guest using a registered user's email doesn't touch the user's cart or orders.
+        user = User.objects.create(username='owner', email='guest@example.com')
+        order = Order.objects.create(customer=user.customer)
+        OrderItem.objects.create(order=order, product=self.product, quantity=5)
+        self.checkout()
+        self.assertEqual(order.orderitem_set.get().quantity, 5)
+        self.assertFalse(Order.objects.filter(customer=user.customer, complete=True).exists())
+        guest_order = Order.objects.get(complete=True)
+        self.assertIsNone(guest_order.customer.user)
+
+    def test_malformed_checkout_rejected(self):
+        #Test a checkout with missing or malformed fields gets a 400 and saves nothing.
+        self.assertEqual(self.checkout(shipping={'street': 'Rua 1'}).status_code, 400)
+        self.assertEqual(self.checkout(total='dez').status_code, 400)
+        response = self.client.post(reverse('process_order'), '{not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Customer.objects.exists())
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_incomplete_order_has_no_event(self):
+        #Test no message is saved when the order isn't completed.
+        self.checkout(total='1.00')
+        self.assertEqual(OrderEvent.objects.count(), 0)
+
+    def test_drain_outbox(self):
+        #Test the command sends the pending events once.
+        self.checkout()
+        self.checkout()
+        out = StringIO()
+        call_command('drain_outbox', batch_size=1, stdout=out)
+        self.assertIn('2 eventos enviados', out.getvalue())
+        self.assertFalse(OrderEvent.objects.filter(sent_at__isnull=True).exists())
+        self.assertEqual(len(get_publisher().backend.messages), 2)
+
+        call_command('drain_outbox', stdout=out)
+        self.assertEqual(len(get_publisher().backend.messages), 2)
+
+    @override_settings(ORDER_EVENTS_BACKEND='website.tests.FailingBackend')
+    def test_drain_outbox_failure(self):
+        #Test events stay in the outbox when the broker is down.
+        self.checkout()
+        with self.assertLogs('website.sendmessage', level='ERROR'):
+            with self.assertRaises(CommandError):
+                call_command('drain_outbox', stdout=StringIO())
+        event = OrderEvent.objects.get()
+        self.assertIsNone(event.sent_at)
+        self.assertEqual(event.attempts, 1)
+
+    @override_settings(ORDER_EVENTS_BACKEND='website.tests.HangingBackend', ORDER_EVENTS_SEND_TIMEOUT=0.1)
+    def test_timed_out_batch_fails(self):
+        #Test a broker that doesn't answer fails the whole batch once, without a timeout per event.
+        self.checkout()
+        self.checkout()
+        start = time.monotonic()
+        with self.assertLogs('website.outbox', level='ERROR'):
+            self.assertEqual(drain_batch(), (0, 2))
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(list(OrderEvent.objects.values_list('attempts', flat=True)), [1, 1])
+
+    def test_loop_backs_off(self):
+        #Test each failed pass in a row doubles the wait, up to the maximum, and a sent batch resets it.
+        results = iter([(0, 1), (0, 1), (0, 1), (0, 1), (1, 0), (0, 0), (0, 1)])
+        delays = []
+
+        def sleep(delay):
+            delays.append(delay)
+            if len(delays) == 6:
+                raise KeyboardInterrupt
+
+        with mock.patch('website.management.commands.drain_outbox.drain_batch', side_effect=lambda size: next(results)):
+            with mock.patch('website.management.commands.drain_outbox.time.sleep', side_effect=sleep):
+                with self.assertRaises(KeyboardInterrupt):
+                    call_command('drain_outbox', loop=True, interval=1, max_interval=5, stdout=StringIO())
+        self.assertEqual(delays, [2, 4, 5, 5, 1, 2])
+
+    @override_settings(ORDER_EVENTS_BACKEND='website.tests.FlakyBackend')
+    def test_failed_event_sent_by_next_pass(self):
+        #Test an event that failed is sent by the following pass.
+        self.checkout()
+        with self.assertLogs('website.sendmessage', level='ERROR'):
+            self.assertEqual(drain_batch(), (0, 1))
+        self.assertEqual(drain_batch(), (1, 0))
+        self.assertEqual(OrderEvent.objects.get().attempts, 2)
+
+    @override_settings(ORDER_EVENTS_BACKEND='website.tests.PoisonBackend', ORDER_EVENTS_MAX_ATTEMPTS=2)
+    def test_poison_event_given_up(self):
+        #Test an event the broker always rejects doesn't block the others and stops being retried.
+        poison = OrderEvent.objects.create(payload='poison')
+        OrderEvent.objects.create(payload='good')
+        with self.assertLogs('website.sendmessage', level='ERROR'):
+            self.assertEqual(drain_batch(), (1, 1))
+        with self.assertLogs('website', level='ERROR') as logs:
+            self.assertEqual(drain_batch(), (0, 1))
+        self.assertIn('Gave up', logs.output[-1])
+        self.assertEqual(drain_batch(), (0, 0))
+        self.assertEqual(get_publisher().backend.messages, ['good'])
+
+        out = StringIO()
+        with self.assertLogs('website.sendmessage', level='ERROR'):
+            with self.assertRaises(CommandError):
+                call_command('drain_outbox', retry_failed=True, stdout=out)
+        self.assertIn('1 eventos voltam a ser enviados', out.getvalue())
+        poison.refresh_from_db()
+        self.assertEqual(poison.attempts, 1)
+
+
+class UpdateItemTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        category = Category.objects.create(name='Test Category')
+        self.product = Product.objects.create(name='Test Product', category=category, price=2.50, description='Test')
+
+    def update(self, action, productId=None):
+        return self.client.post(reverse('update_item'), json.dumps({
+            'productId': productId or self.product.id, 'action': action,
+        }), content_type='application/json')
+
+    def test_add_and_remove(self):
+        #Test the endpoint returns the new quantity and cart totals.
+        self.update('add')
+        data = self.update('add').json()
+        self.assertEqual(data, {'productId': self.product.id, 'quantity': 2, 'lineTotal': 5.0, 'cartItems': 2, 'cartTotal': 5.0})
+        data = self.update('remove').json()
+        self.assertEqual(data['quantity'], 1)
+        self.assertEqual(data['cartTotal'], 2.5)
+
+    def test_line_deleted_at_zero(self):
+        #Test removing the last unit deletes the line.
+        self.update('add')
+        data = self.update('remove').json()
+        self.assertEqual(data['quantity'], 0)
+        self.assertEqual(data['cartItems'], 0)
+        self.assertEqual(OrderItem.objects.count(), 0)
+
+    def test_one_line_per_product(self):
+        #Test repeated adds update a single line.
+        for _ in range(5):
+            self.update('add')
+        line = OrderItem.objects.get()
+        self.assertEqual(line.quantity, 5)
+        with self.assertRaises(IntegrityError):
+            OrderItem.objects.create(order=line.order, product=self.product, quantity=1)
+
+    def test_concurrent_first_add(self):
+        #Test a line created by another request between the update and the insert is incremented instead.
+        get_product = Product.objects.get
+
+        def other_request_adds(**kwargs):
+            order = Order.objects.get(customer=self.user.customer, complete=False)
+            OrderItem.objects.create(order=order, product=self.product, quantity=1)
+            return get_product(**kwargs)
+
+        with mock.patch.object(Product.objects, 'get', side_effect=other_request_adds):
+            response = self.update('add')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['quantity'], 2)
+        self.assertEqual(OrderItem.objects.get().quantity, 2)
+
+    def test_invalid_requests(self):
+        #Test unknown products and actions are rejected.
+        self.assertEqual(self.update('add', productId=999999).status_code, 404)
+        self.assertEqual(self.update('add', productId='abc').status_code, 400)
+        self.assertEqual(self.update('delete').status_code, 400)
+        self.assertEqual(OrderItem.objects.count(), 0)
+
+    def test_anonymous_request(self):
+        #Test a guest gets 401 instead of an error.
+        self.client.logout()
+        response = self.update('add')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(OrderItem.objects.count(), 0)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class CartMergeTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        category = Category.objects.create(name='Test Category')
+        self.first = Product.objects.create(name='First', category=category, price=2, description='Test')
+        self.second = Product.objects.create(name='Second', category=category, price=3, description='Test')
+
+    def set_cart(self, cart):
+        self.client.cookies['cart'] = json.dumps({str(product_id): {'quantity': quantity} for product_id, quantity in cart.items()})
+
+    def lines(self):
+        order = Order.objects.get(customer=self.user.customer, complete=False)
+        return dict(order.orderitem_set.values_list('product__name', 'quantity'))
+
+    def test_login_merges_cookie_cart(self):
+        #Test logging in adds the cookie cart to the open order and clears the cookie.
+        order = Order.objects.create(customer=self.user.customer)
+        OrderItem.objects.create(order=order, product=self.first, quantity=1)
+        self.set_cart({self.first.id: 2, self.second.id: 1, 999: 4})
+
+        response = self.client.post(reverse('login'), {'username': 'testuser', 'password': 'testpassword'})
+        self.assertEqual(self.lines(), {'First': 3, 'Second': 1})
+        self.assertEqual(response.cookies['cart'].value, '')
+        self.assertEqual(response.cookies['cart']['max-age'], 0)
+
+    def test_signup_merges_cookie_cart(self):
+        #Test a new account starts with the guest's cart.
+        self.set_cart({self.second.id: 2})
+        self.client.post(reverse('signup'), {
+            'username': 'newuser', 'first_name': 'Ana', 'last_name': 'Silva', 'email': 'ana@example.com',
+            'password1': 'Plantas#2024', 'password2': 'Plantas#2024',
+        })
+        self.user = User.objects.get(username='newuser')
+        self.assertEqual(self.lines(), {'Second': 2})
+
+    def test_merge_writes_lines_in_one_statement(self):
+        #Test the lines are upserted with a single insert however many there are.
+        self.set_cart({self.first.id: 1, self.second.id: 2})
+        request = RequestFactory().get('/')
+        request.COOKIES['cart'] = self.client.cookies['cart'].value
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(mergeCookieCart(request, self.user), 2)
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "website_orderitem"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(self.lines(), {'First': 1, 'Second': 2})
+
+    def test_empty_cookie_cart(self):
+        #Test logging in without a cookie cart runs no cart queries and sets no cookie.
+        request = RequestFactory().get('/')
+        with self.assertNumQueries(0):
+            self.assertEqual(mergeCookieCart(request, self.user), 0)
+        response = self.client.post(reverse('login'), {'username': 'testuser', 'password': 'testpassword'})
+        self.assertNotIn('cart', response.cookies)
+
+
+class CartBadgeTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='testuser')
+        category = Category.objects.create(name='Test Category')
+        self.product = Product.objects.create(name='Test Product', category=category, price=2, description='Test')
+
+    def badge(self, response):
+        return response.context['cartItems']
+
+    def test_get_doesnt_create_order(self):
+        #Test showing the cart pages to a user without an order doesn't create one.
+        self.client.force_login(self.user)
+        for name in ('store', 'cart', 'checkout', 'home'):
+            response = self.client.get(reverse(name))
+            self.assertEqual(str(self.badge(response)), '0')
+        self.assertFalse(Order.objects.exists())
+
+    def test_badge_is_cached_until_cart_changes(self):
+        #Test the badge is read from the cache and refreshed after a product is added.
+        self.client.force_login(self.user)
+        self.client.get(reverse('home'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'))
+            self.assertEqual(str(self.badge(response)), '0')
+        self.assertFalse([query for query in queries if 'website_orderitem' in query['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('update_item'), json.dumps({'productId': self.product.id, 'action': 'add'}), content_type='application/json')
+        self.assertEqual(str(self.badge(self.client.get(reverse('home')))), '1')
+
+    def test_guest_badge_follows_cookie(self):
+        #Test a guest's badge counts the products in the cookie.
+        self.assertEqual(str(self.badge(self.client.get(reverse('home')))), '0')
+        self.client.cookies['cart'] = json.dumps({str(self.product.id): {'quantity': 3}})
+        self.assertEqual(str(self.badge(self.client.get(reverse('home')))), '3')
+
+
+class CartApiTestCase(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Test Category')
+        self.product = Product.objects.create(name='Test Product', category=category, price=2.50, description='Test')
+        self.other = Product.objects.create(name='Other Product', category=category, price=1, description='Test')
+
+    def post(self, action, productId=None):
+        return self.client.post(reverse('cart_api'), json.dumps({
+            'productId': productId or self.product.id, 'action': action,
+        }), content_type='application/json')
+
+    def test_guest_summary(self):
+        #Test the guest cart summary is read from the cookie.
+        self.client.cookies['cart'] = json.dumps({str(self.product.id): {'quantity': 2}, str(self.other.id): {'quantity': 1}})
+        data = self.client.get(reverse('cart_api')).json()
+        self.assertEqual(data['cartItems'], 3)
+        self.assertEqual(data['cartTotal'], 6.0)
+        self.assertEqual(data['lines'][0], {'productId': self.product.id, 'quantity': 2, 'lineTotal': 5.0})
+
+    def test_guest_mutation(self):
+        #Test the guest cart is updated and returned for the cookie.
+        self.client.cookies['cart'] = json.dumps({str(self.product.id): {'quantity': 1}})
+        data = self.post('add').json()
+        self.assertEqual(data['quantity'], 2)
+        self.assertEqual(data['cartTotal'], 5.0)
+        self.assertEqual(data['cart'], {str(self.product.id): {'quantity': 2}})
+
+        self.client.cookies['cart'] = json.dumps({str(self.product.id): {'quantity': 1}})
+        data = self.post('remove').json()
+        self.assertEqual(data['quantity'], 0)
+        self.assertEqual(data['cart'], {})
+
+    def test_guest_unknown_product(self):
+        #Test adding a product that doesn't exist is rejected.
+        self.assertEqual(self.post('add', productId=999999).status_code, 404)
+
+    def test_user_summary_and_mutation(self):
+        #Test the customer cart is read and updated in the database.
+        User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        self.post('add')
+        data = self.post('add', productId=self.other.id).json()
+        self.assertEqual(data['cartItems'], 2)
+        self.assertNotIn('cart', data)
+
+        data = self.client.get(reverse('cart_api')).json()
+        self.assertEqual(data['cartTotal'], 3.5)
+        self.assertEqual(len(data['lines']), 2)
+
+    def test_invalid_requests(self):
+        #Test bad actions and methods are rejected.
+        self.assertEqual(self.post('delete').status_code, 400)
+        self.assertEqual(self.client.put(reverse('cart_api')).status_code, 405)
+
+    def test_malformed_body(self):
+        #Test a body that isn't a JSON object gets a 400 from both cart endpoints.
+        self.client.force_login(User.objects.create(username='buyer'))
+        for url in (reverse('cart_api'), reverse('update_item')):
+            for body in ('{not json', '[1, 2]', '{}'):
+                response = self.client.post(url, body, content_type='application/json')
+                self.assertEqual(response.status_code, 400, (url, body))
+
+
+class HotQueryIndexTestCase(TestCase):
+    def test_hot_queries_use_indexes(self):
+        #Test every hot query is answered through an index.
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        self.assertIn(f'{len(HOT_QUERIES)}/{len(HOT_QUERIES)} consultas usam índice', out.getvalue())
+
+    def test_one_open_order_per_customer(self):
+        #Test a customer can't have two open orders.
+        customer = Customer.objects.create(name='testname', email='testemail')
+        Order.objects.create(customer=customer, complete=True)
+        Order.objects.create(customer=customer, complete=True)
+        Order.objects.create(customer=customer, complete=False)
+        with self.assertRaises(IntegrityError):
+            Order.objects.create(customer=customer, complete=False)
+
+
+class ViewQueryCountTestCase(TestCase):
+    # Views whose query count must not grow with the data
+    CONSTANT_VIEWS = ['login', 'store', 'store (cold cache)', 'cart', 'checkout', 'forum', 'question', 'challenge', 'updateItem', 'processOrder']
+
+    def test_query_counts_dont_grow_with_cart_size(self):
+        #Test the cart views run the same number of queries for 2 and 20 cart lines.
+        user, question = seed_dataset(products=30, questions=3, answers=2, cart_lines=2)
+        small = run_benchmarks(user, question, cart_lines=2, runs=1)
+        large = run_benchmarks(user, question, cart_lines=20, runs=1)
+        for name in self.CONSTANT_VIEWS:
+            self.assertEqual(small[name]['queries'], large[name]['queries'], name)
+
+    def test_compare_to_baseline(self):
+        #Test only views over their baseline are reported.
+        baseline = {'store': {'queries': 5, 'p95_ms': 10}, 'cart': {'queries': 6, 'p95_ms': 10}}
+        results = {'store': {'queries': 6, 'p95_ms': 5}, 'cart': {'queries': 6, 'p95_ms': 30}, 'forum': {'queries': 1, 'p95_ms': 1}}
+        self.assertEqual(compare_to_baseline(results, baseline), ['store: 6 queries (baseline 5)'])
+        self.assertEqual(len(compare_to_baseline(results, baseline, time_tolerance=0.5)), 2)
+
+
+class SeedDbTestCase(TestCase):
+    def seed(self, **options):
+        out = StringIO()
+        call_command('seed_db', stdout=out, **options)
+        return out.getvalue()
+
+    def test_default_dataset(self):
+        #Test the default run creates the sample data.
+        self.seed()
+        self.assertEqual(Category.objects.count(), 6)
+        self.assertEqual(Product.objects.count(), 10)
+        self.assertEqual(Question.objects.count(), 2)
+        self.assertEqual(Answer.objects.count(), 2)
+        self.assertEqual(Challenge.objects.filter(date=datetime.date.today()).count(), 2)
+        self.assertTrue(self.client.login(username='utilizador_teste', password='password123'))
+
+    def test_scaled_dataset(self):
+        #Test the size parameters and the rows/second report.
+        out = self.seed(products=120, users=15, questions=30, answers=3, orders=25, challenges_per_day=3, days=4, batch_size=7)
+        self.assertEqual(Product.objects.count(), 120)
+        self.assertEqual(User.objects.count(), 15)
+        self.assertEqual(Customer.objects.count(), 15)
+        self.assertEqual(Answer.objects.count(), 90)
+        self.assertEqual(Order.objects.filter(complete=True).count(), 25)
+        self.assertEqual(Address.objects.count(), 25)
+        self.assertEqual(Challenge.objects.count(), 12)
+        self.assertIn('linhas/s', out)
+
+    def test_same_seed_same_data(self):
+        #Test the same seed generates the same data and a rerun replaces it.
+        self.seed(products=50, orders=10, seed=7)
+        first = list(Product.objects.order_by('name').values_list('name', 'price', 'category__name'))
+        lines = list(OrderItem.objects.order_by('order__transaction_id', 'product__name').values_list('product__name', 'quantity'))
+        self.seed(products=50, orders=10, seed=7)
+        self.assertEqual(list(Product.objects.order_by('name').values_list('name', 'price', 'category__name')), first)
+        self.assertEqual(list(OrderItem.objects.order_by('order__transaction_id', 'product__name').values_list('product__name', 'quantity')), lines)
+        self.assertEqual(Order.objects.count(), 10)
+
+    def test_rerun_clears_without_signals(self):
+        #Test a rerun clears the old rows and what cascades from them without a delete signal per row.
+        self.seed(products=20, users=4, questions=6, answers=3, orders=5)
+        customer = User.objects.get(username='utilizador_teste').customer
+        order = Order.objects.create(customer=customer, complete=True, transaction_id='real-1')
+        OrderItem.objects.create(order=order, product=Product.objects.first(), quantity=1)
+        with mock.patch.object(post_delete, 'send') as send:
+            self.seed(products=20, users=4, questions=6, answers=3, orders=5)
+        send.assert_not_called()
+        self.assertEqual((User.objects.count(), Customer.objects.count()), (4, 4))
+        self.assertEqual((Question.objects.count(), Answer.objects.count()), (6, 18))
+        self.assertEqual(Order.objects.filter(transaction_id__startswith='seed-').count(), 5)
+        self.assertFalse(order.orderitem_set.exists())
+        self.assertEqual(len(SearchResults('questions', 'pergunta')[0:100]), Question.objects.filter(title__startswith='Pergunta').count())
+
+
+class ForumListingTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+
+    def add_questions(self, count):
+        questions = [Question.objects.create(user=self.user, title=f'Pergunta {i}', body='Texto') for i in range(count)]
+        # Several questions share a timestamp so the id breaks the tie
+        Question.objects.filter(id__in=[q.id for q in questions[:10]]).update(created_at=questions[0].created_at)
+        return questions
+
+    def test_pages_newest_first(self):
+        #Test every question is listed once, newest first, across pages.
+        self.add_questions(45)
+        seen = []
+        cursor = None
+        while True:
+            questions, cursor = forum_page(cursor, limit=20)
+            seen.extend(questions)
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 45)
+        self.assertEqual(len({q.id for q in seen}), 45)
+        self.assertEqual(seen, sorted(seen, key=lambda q: (q.created_at, q.id), reverse=True))
+
+    def test_answer_counts(self):
+        #Test the answer count is annotated on each question.
+        first, second = self.add_questions(2)
+        for _ in range(3):
+            Answer.objects.create(user=self.user, question=first, body='Resposta')
+        counts = {q.id: q.answer_count for q in forum_page()[0]}
+        self.assertEqual(counts, {first.id: 3, second.id: 0})
+
+    def test_query_count_is_fixed(self):
+        #Test the listing doesn't run one query per question.
+        self.add_questions(3)
+        with self.assertNumQueries(1):
+            [q.user.username for q in forum_page()[0]]
+        self.add_questions(30)
+        with self.assertNumQueries(1):
+            [q.user.username for q in forum_page()[0]]
+
+    def test_forum_view_pagination(self):
+        #Test the forum page links to the next page.
+        self.add_questions(25)
+        response = self.client.get(reverse('forum'))
+        self.assertEqual(len(response.context['questions']), 20)
+        self.assertContains(response, 'Mais antigas')
+        response = self.client.get(reverse('forum'), {'cursor': response.context['next_cursor']})
+        self.assertEqual(len(response.context['questions']), 5)
+        self.assertNotContains(response, 'Mais antigas')
+        self.assertContains(response, '0 respostas')
+
+    def test_invalid_cursor(self):
+        #Test a bad cursor shows the first page.
+        self.add_questions(3)
+        response = self.client.get(reverse('forum'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(len(response.context['questions']), 3)
+
+
+class QuestionCountersTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.first = Question.objects.create(user=self.user, title='Primeira', body='Texto')
+        self.second = Question.objects.create(user=self.user, title='Segunda', body='Texto')
+
+    def test_counters_follow_answers(self):
+        #Test creating and deleting answers updates the counters.
+        answer = Answer.objects.create(user=self.user, question=self.first, body='Resposta')
+        latest = Answer.objects.create(user=self.user, question=self.first, body='Resposta')
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.answer_count, 2)
+        self.assertEqual(self.first.last_activity_at, latest.created_at)
+
+        latest.delete()
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.answer_count, 1)
+        self.assertEqual(self.first.last_activity_at, answer.created_at)
+
+        answer.delete()
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.answer_count, 0)
+        self.assertEqual(self.first.last_activity_at, self.first.created_at)
+
+    def test_answer_from_question_page(self):
+        #Test answering through the question page updates the counter.
+        self.client.login(username='testuser', password='testpassword')
+        self.client.post(reverse('question', args=[self.first.id]), {'body': 'Resposta'})
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.answer_count, 1)
+
+    def test_sort_by_activity(self):
+        #Test the forum can list the most recently answered questions first.
+        Answer.objects.create(user=self.user, question=self.first, body='Resposta')
+        questions, cursor = forum_page(sort='activity')
+        self.assertEqual(questions, [self.first, self.second])
+        questions, cursor = forum_page(sort='recent')
+        self.assertEqual(questions, [self.second, self.first])
+
+    def test_recount_answers(self):
+        #Test the command rebuilds wrong counters.
+        answer = Answer.objects.create(user=self.user, question=self.second, body='Resposta')
+        Question.objects.update(answer_count=99)
+        out = StringIO()
+        call_command('recount_answers', batch_size=1, stdout=out)
+        self.assertIn('2 perguntas atualizadas', out.getvalue())
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.answer_count, self.second.answer_count), (0, 1))
+        self.assertEqual(self.second.last_activity_at, answer.created_at)
+
+
+class QuestionPageTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='testuser')
+        self.client.force_login(self.user)
+        self.question = Question.objects.create(user=self.user, title='Pergunta', body='Texto')
+
+    def add_answers(self, count):
+        users = [User.objects.create(username=f'user{i}-{User.objects.count()}') for i in range(count)]
+        return [Answer.objects.create(user=user, question=self.question, body=f'Resposta {i}') for i, user in enumerate(users)]
+
+    def test_unknown_question(self):
+        #Test an unknown question id returns 404 instead of an error.
+        response = self.client.get(reverse('question', args=[self.question.id + 1]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_answers_are_paginated_oldest_first(self):
+        #Test the answers come in pages in the order they were posted.
+        answers = self.add_answers(ANSWER_PAGE_SIZE + 5)
+        page, cursor = answers_page(self.question.id)
+        self.assertEqual(page, answers[:ANSWER_PAGE_SIZE])
+        page, next_cursor = answers_page(self.question.id, cursor)
+        self.assertEqual(page, answers[ANSWER_PAGE_SIZE:])
+        self.assertIsNone(next_cursor)
+
+        response = self.client.get(reverse('question', args=[self.question.id]), {'cursor': cursor})
+        self.assertContains(response, f'Resposta {ANSWER_PAGE_SIZE + 4}')
+        self.assertNotContains(response, 'Resposta 0<')
+
+    def test_invalid_cursor_shares_first_page(self):
+        #Test invalid or overlong cursors are served the cached first page instead of new cache keys.
+        self.add_answers(3)
+        first = render_answers(self.question.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(render_answers(self.question.id, 'nada'), first)
+            self.assertEqual(render_answers(self.question.id, 'x' * 1000), first)
+
+    def test_queries_dont_grow_with_answers(self):
+        #Test the page runs the same number of queries for few or many answers, and fewer once cached.
+        url = reverse('question', args=[self.question.id])
+        # The first request also caches the cart badge
+        self.client.get(url)
+        self.add_answers(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        self.add_answers(ANSWER_PAGE_SIZE)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as cached:
+            response = self.client.get(url)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(cached), len(many) - 1)
+        self.assertContains(response, 'user0-')
+
+    def test_new_answer_refreshes_cached_page(self):
+        #Test a cached page of answers shows an answer posted after it was cached.
+        url = reverse('question', args=[self.question.id])
+        self.client.get(url)
+        self.client.post(url, {'body': 'Resposta nova'})
+        self.assertContains(self.client.get(url), 'Resposta nova')
+
+
+class SearchTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.category = Category.objects.create(name='Plantas')
+
+    def add_product(self, name, description='Produto'):
+        return Product.objects.create(name=name, category=self.category, price=Decimal('5.00'), description=description)
+
+    def results(self, query, kind='products', index=None):
+        return list(SearchResults(kind, query, index)[0:20])
+
+    def test_tokenize(self):
+        #Test accents, case, stopwords and plurals are folded away.
+        self.assertEqual(tokenize('Árvores de Limões'), ['arvor', 'limao'])
+        self.assertEqual(tokenize('ÁRVORE'), tokenize('arvores'))
+        self.assertEqual(tokenize('flores'), tokenize('flor'))
+
+    def test_accent_folding(self):
+        #Test "arvore" finds "Árvore Bonsai" and the other way round.
+        bonsai = self.add_product('Árvore Bonsai')
+        self.add_product('Vaso com Cacto', 'Cacto em vaso')
+        self.assertEqual(self.results('arvore'), [bonsai])
+        self.assertEqual(self.results('ÁRVORES'), [bonsai])
+
+    def test_every_term_must_match(self):
+        #Test a query with several words only returns documents holding all of them.
+        tomato = self.add_product('Planta de Tomate', 'Planta pronta para ser plantada')
+        self.add_product('Planta de Hortelã')
+        self.assertEqual(self.results('planta tomate'), [tomato])
+        self.assertEqual(self.results('de'), [])
+
+    def test_title_ranks_first(self):
+        #Test a match in the name ranks above a match in the description.
+        body = self.add_product('Vaso', 'Ideal para um cacto')
+        title = self.add_product('Cacto', 'Planta de interior')
+        self.assertEqual(self.results('cacto'), [title, body])
+
+    def test_index_follows_changes(self):
+        #Test saving and deleting a product updates the index.
+        product = self.add_product('Sementes de Rosa')
+        product.name = 'Sementes de Girassol'
+        product.save()
+        self.assertEqual(self.results('rosa'), [])
+        self.assertEqual(self.results('girassol'), [product])
+        product.delete()
+        self.assertEqual(self.results('girassol'), [])
+
+    def test_question_found_by_answer(self):
+        #Test a question can be found through the text of its answers.
+        question = Question.objects.create(user=self.user, title='Folhas castanhas', body='O que se passa?')
+        answer = Answer.objects.create(user=self.user, question=question, body='Excesso de rega ou fungos.')
+        self.assertEqual(self.results('fungo', 'questions'), [question])
+        answer.delete()
+        self.assertEqual(self.results('fungo', 'questions'), [])
+
+    def test_answers_indexed_incrementally(self):
+        #Test posting, editing and deleting an answer only adds or takes out its own words, in both indexes.
+        for index in (FtsIndex(connection), TermIndex()):
+            with self.subTest(index=type(index).__name__), mock.patch('website.search.get_index', return_value=index):
+                question = Question.objects.create(user=self.user, title='Folhas castanhas', body='O que se passa?')
+                first = Answer.objects.create(user=self.user, question=question, body='Excesso de rega.')
+                second = Answer.objects.create(user=self.user, question=question, body='Fungos nas folhas, rega menos.')
+                self.assertEqual(self.results('fungo', 'questions', index), [question])
+
+                second.body = 'Falta de luz.'
+                second.save()
+                self.assertEqual(self.results('fungo', 'questions', index), [])
+                self.assertEqual(self.results('luz rega', 'questions', index), [question])
+                first.delete()
+                self.assertEqual(self.results('rega', 'questions', index), [])
+                self.assertEqual(self.results('folha luz', 'questions', index), [question])
+
+                if isinstance(index, TermIndex):
+                    terms = sorted(SearchTerm.objects.filter(kind='questions').values_list('object_id', 'term', 'weight'))
+                    rebuild_index('questions', index=index)
+                    self.assertEqual(sorted(SearchTerm.objects.filter(kind='questions').values_list('object_id', 'term', 'weight')), terms)
+                question.delete()
+
+    def test_answers_query_count(self):
+        #Test posting an answer costs the same queries however many answers the question has.
+        question = Question.objects.create(user=self.user, title='Folhas castanhas', body='O que se passa?')
+        Answer.objects.create(user=self.user, question=question, body='Primeira resposta.')
+        with CaptureQueriesContext(connection) as few:
+            Answer.objects.create(user=self.user, question=question, body='Rega menos.')
+        Answer.objects.bulk_create([Answer(user=self.user, question=question, body=f'Resposta {i}') for i in range(30)])
+        with CaptureQueriesContext(connection) as many:
+            Answer.objects.create(user=self.user, question=question, body='Rega menos.')
+        self.assertEqual(len(few), len(many))
+
+    def test_deleted_question_not_reindexed_per_answer(self):
+        #Test deleting a question drops its document once instead of re-indexing it for every answer.
+        question = Question.objects.create(user=self.user, title='Folhas castanhas', body='O que se passa?')
+        for i in range(5):
+            Answer.objects.create(user=self.user, question=question, body=f'Resposta {i}')
+        with mock.patch.object(FtsIndex, 'remove_text') as fts, mock.patch.object(TermIndex, 'remove_text') as terms:
+            question.delete()
+        fts.assert_not_called()
+        terms.assert_not_called()
+        self.assertEqual(self.results('folha', 'questions'), [])
+
+    def test_indexing_paused(self):
+        #Test bulk changes can turn the receivers off and rebuild the index afterwards.
+        question = Question.objects.create(user=self.user, title='Folhas castanhas', body='O que se passa?')
+        with indexing_paused():
+            Answer.objects.create(user=self.user, question=question, body='Fungos.')
+            self.add_product('Girassol')
+        self.assertEqual(self.results('fungo', 'questions'), [])
+        self.assertEqual(self.results('girassol'), [])
+        rebuild_index('questions')
+        rebuild_index('products')
+        self.assertEqual(self.results('fungo', 'questions'), [question])
+        self.assertEqual([p.name for p in self.results('girassol')], ['Girassol'])
+
+    def test_term_index_matches_fts(self):
+        #Test the SearchTerm index returns the same ranking as the default index.
+        for i in range(5):
+            self.add_product(f'Vaso {i}', 'Vaso de barro ' * i)
+        rebuild_index('products', index=TermIndex())
+        self.assertEqual(SearchTerm.objects.filter(kind='products', term='vaso').count(), 5)
+        self.assertEqual(self.results('vasos barro', index=TermIndex()), self.results('vasos barro'))
+        self.assertEqual(SearchResults('products', 'vaso', TermIndex()).count(), 5)
+
+    def test_rebuild_after_bulk_create(self):
+        #Test rows written without signals are found after rebuild_search_index.
+        Product.objects.bulk_create([Product(name='Gel de Aloé Vera', category=self.category, price=1, description='Gel')])
+        self.assertEqual(self.results('aloe'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual([p.name for p in self.results('aloe')], ['Gel de Aloé Vera'])
+
+    def test_search_view_pages(self):
+        #Test the search page is paginated and counts every result.
+        for i in range(25):
+            self.add_product(f'Vaso {i}')
+        response = self.client.get(reverse('search'), {'q': 'vaso'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page'].paginator.count, 25)
+        self.assertEqual(len(response.context['results']), 20)
+        response = self.client.get(reverse('search'), {'q': 'vaso', 'page': 2})
+        self.assertEqual(len(response.context['results']), 5)
+
+    def test_search_view_questions(self):
+        #Test the questions tab and an empty query.
+        question = Question.objects.create(user=self.user, title='Como propagar suculentas?', body='Dicas?')
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('search'), {'q': 'suculenta', 'type': 'questions'})
+        self.assertEqual(list(response.context['results']), [question])
+        response = self.client.get(reverse('search'), {'q': ''})
+        self.assertEqual(response.context['page'].paginator.count, 0)
+
+    def test_anonymous_question_search(self):
+        #Test visitors who aren't logged in are sent to the login page instead of seeing forum questions.
+        Question.objects.create(user=self.user, title='Como propagar suculentas?', body='Dicas?')
+        response = self.client.get(reverse('search'), {'q': 'suculenta', 'type': 'questions'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(reverse('login')))
+        response = self.client.get(reverse('search'), {'q': 'suculenta'})
+        self.assertNotContains(response, 'type=questions')
+
+
+MEMORY_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+@override_settings(IMAGE_VARIANTS_ASYNC=False, STORAGES=MEMORY_STORAGES)
+class ImageVariantTestCase(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Plantas')
+
+    def upload(self, width, height, mode='RGB', format='JPEG', name='rosa.jpg'):
+        buffer = BytesIO()
+        Image.new(mode, (width, height)).save(buffer, format)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def add_product(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(name='Rosa', category=self.category, price=1, description='Rosa', image=image)
+
+    def test_variants_generated_on_upload(self):
+        #Test every width is saved in WebP and JPEG next to the original.
+        product = self.add_product(self.upload(2000, 1000))
+        product.refresh_from_db()
+        variants = product.image_variants
+        self.assertEqual(variants['source'], product.image.name)
+        self.assertEqual(sorted(variants['webp'], key=int), ['320', '640', '1280'])
+        with Image.open(default_storage.open(variants['webp']['640'])) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (640, 320)))
+        with Image.open(default_storage.open(variants['jpeg']['320'])) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (320, 160)))
+        self.assertTrue(variants['jpeg']['1280'].startswith('product/'))
+
+    def test_small_images_are_not_upscaled(self):
+        #Test an image narrower than the largest width keeps its own size.
+        product = self.add_product(self.upload(500, 500, 'RGBA', 'PNG', 'cacto.png'))
+        product.refresh_from_db()
+        self.assertEqual(sorted(product.image_variants['jpeg'], key=int), ['320', '500'])
+
+    def test_removed_image_is_skipped(self):
+        #Test rows whose image was removed or deleted before the worker ran are skipped.
+        product = Product.objects.create(name='Rosa', category=self.category, price=1, description='Rosa', image=self.upload(400, 400))
+        Product.objects.filter(pk=product.pk).update(image='')
+        self.assertFalse(process_image(Product, product.pk))
+        self.assertFalse(process_image(Product, product.pk + 1))
+
+    def test_replaced_image_variants_deleted(self):
+        #Test replacing or removing the image deletes the copies of the old one.
+        product = self.add_product(self.upload(800, 400))
+        product.refresh_from_db()
+        old = list(product.image_variants['webp'].values()) + list(product.image_variants['jpeg'].values())
+
+        product.image = self.upload(700, 350, name='tulipa.jpg')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        self.assertFalse(any(default_storage.exists(name) for name in old))
+        new = list(product.image_variants['webp'].values())
+        self.assertTrue(all(default_storage.exists(name) for name in new))
+
+        product.image = None
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertFalse(any(default_storage.exists(name) for name in new))
+
+    def test_deleted_row_variants_deleted(self):
+        #Test deleting the row deletes its copies.
+        product = self.add_product(self.upload(800, 400))
+        product.refresh_from_db()
+        names = list(product.image_variants['jpeg'].values())
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+
+    def test_srcset_tag(self):
+        #Test the template tag emits srcset once the variants exist, and the original before.
+        template = Template('{% load images %}{% responsive_image product.image sizes="17rem" class="card-img-top" %}')
+        product = Product.objects.create(name='Rosa', category=self.category, price=1, description='Rosa', image=self.upload(800, 400))
+        html = template.render(Context({'product': product}))
+        self.assertNotIn('srcset', html)
+        self.assertIn(product.image.url, html)
+
+        process_image(Product, product.pk)
+        product.refresh_from_db()
+        html = template.render(Context({'product': product}))
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('_320w.webp 320w', html)
+        self.assertIn('_640w.jpg 640w', html)
+        self.assertIn('class="card-img-top"', html)
+
+    def test_worker_runs_in_background(self):
+        #Test the worker hands every row to its handler on its own thread.
+        calls = []
+        worker = VariantWorker(handler=lambda model, pk: calls.append((model, pk, threading.current_thread().name)))
+        worker.submit(Product, 1)
+        worker.submit(Question, 2)
+        self.assertTrue(worker.flush(timeout=5))
+        self.assertEqual(calls, [(Product, 1, 'image-variants'), (Question, 2, 'image-variants')])
+
+    def test_full_queue_drops(self):
+        #Test submit doesn't block the request when the queue is full.
+        release = threading.Event()
+        worker = VariantWorker(handler=lambda model, pk: release.wait(5), max_queue=1)
+        self.assertTrue(worker.submit(Product, 1))
+        # The first row is being processed, the second one fills the queue
+        while worker.queue.qsize():
+            pass
+        self.assertTrue(worker.submit(Product, 2))
+        with self.assertLogs('website.images', 'WARNING'):
+            self.assertFalse(worker.submit(Product, 3))
+        release.set()
+        self.assertTrue(worker.flush(timeout=5))
+
+
+class FileStorageTestCase(TestCase):
+    def test_storage_is_built_on_first_use(self):
+        #Test starting Django doesn't build the file storage or load the Azure SDKs.
+        script = (
+            'import django, sys; django.setup()\n'
+            'from django.core.files.storage import default_storage\n'
+            'from django.utils.functional import empty\n'
+            'print(default_storage._wrapped is empty, any(name.startswith("azure") for name in sys.modules))'
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='core.settings', SECRET_KEY='x', FILE_STORAGE='azure')
+        result = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.split(), ['True', 'False'])
+
+    @override_settings(STORAGES=MEMORY_STORAGES)
+    def test_storage_follows_settings(self):
+        #Test image fields use the storage from STORAGES, one instance for every file.
+        product = Product(name='Rosa', price=1, description='Rosa')
+        product.image.save('rosa.txt', ContentFile(b'rosa'), save=False)
+        self.assertIsInstance(product.image.storage._wrapped, InMemoryStorage)
+        self.assertTrue(default_storage.exists(product.image.name))
+        self.assertIs(Product(image='a').image.storage._wrapped, Question(image='b').image.storage._wrapped)
+
+
+class DailyChallengeTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='testuser')
+        self.client.force_login(self.user)
+        self.today = timezone.localdate()
+        for i in range(5):
+            Challenge.objects.create(text=f'Desafio {i}', correct_answer='Folhas', date=self.today)
+
+    def test_same_challenge_on_every_load(self):
+        #Test refreshing the page shows the same challenge and doesn't touch the session.
+        first = self.client.get(reverse('challenge'))
+        for _ in range(5):
+            response = self.client.get(reverse('challenge'))
+            self.assertEqual(response.context['challenge'], first.context['challenge'])
+        self.assertNotIn('selected_challenge_id', self.client.session)
+        self.assertContains(response, first.context['challenge'].text)
+
+    def test_pick_is_deterministic(self):
+        #Test the pick only depends on the date and the challenges of that day.
+        pick = pick_challenge(self.today)
+        self.assertEqual(pick_challenge(self.today), pick)
+        self.assertIn(pick, Challenge.objects.filter(date=self.today).values_list('id', flat=True))
+
+    def test_pick_is_stored(self):
+        #Test the stored pick stays even when more challenges are added for the day.
+        challenge = daily_challenge()
+        cache.clear()
+        for i in range(5):
+            Challenge.objects.create(text=f'Outro {i}', correct_answer='Folhas', date=self.today)
+        cache.clear()
+        self.assertEqual(daily_challenge(), challenge)
+        self.assertEqual(DailyChallenge.objects.get(date=self.today).challenge, challenge)
+
+    def test_view_is_one_cache_hit(self):
+        #Test the challenge page runs no challenge queries once the pick is cached.
+        daily_challenge()
+        with self.assertNumQueries(0):
+            daily_challenge()
+
+    def test_edit_clears_cache(self):
+        #Test editing the challenge of the day shows up straight away.
+        challenge = daily_challenge()
+        challenge.text = 'Texto novo'
+        challenge.save()
+        self.assertEqual(daily_challenge().text, 'Texto novo')
+
+    def test_moved_challenge_leaves_its_day(self):
+        #Test moving the challenge of the day to another date makes the old day pick again.
+        challenge = daily_challenge()
+        tomorrow = self.today + datetime.timedelta(days=1)
+        challenge.date = tomorrow
+        challenge.save()
+        self.assertNotEqual(daily_challenge(), challenge)
+        self.assertNotEqual(DailyChallenge.objects.get(date=self.today).challenge, challenge)
+        self.assertEqual(daily_challenge(tomorrow), challenge)
+
+    def test_no_challenge(self):
+        #Test a day without challenges shows the empty message.
+        Challenge.objects.all().delete()
+        response = self.client.get(reverse('challenge'))
+        self.assertIsNone(response.context['challenge'])
+        self.assertContains(response, 'Não há nenhum desafio para hoje')
+
+    def test_cached_until_midnight(self):
+        #Test the timeout ends at midnight in the configured time zone.
+        now = timezone.make_aware(datetime.datetime(2024, 3, 10, 23, 59, 30))
+        self.assertEqual(seconds_until_end_of(now.date(), now), 30)
+
+    def test_schedule_command(self):
+        #Test the command stores the pick of the upcoming days.
+        Challenge.objects.create(text='Amanhã', correct_answer='Folhas', date=self.today + datetime.timedelta(days=1))
+        out = StringIO()
+        call_command('schedule_challenges', days=3, stdout=out)
+        self.assertEqual(DailyChallenge.objects.count(), 2)
+        self.assertIn('2 dias', out.getvalue())
+
+
+class ChallengeGradingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='testuser')
+        self.client.force_login(self.user)
+        self.today = timezone.localdate()
+        self.challenge = Challenge.objects.create(
+            text='Que processo transforma luz em energia?', correct_answer='Fotossíntese',
+            synonyms='Fotossintese clorofilina\n  Foto-síntese ', date=self.today,
+        )
+
+    def answer(self, text):
+        return self.client.post(reverse('challenge'), {'user_answer': text})
+
+    def add_days(self, user, days, correct=True):
+        for offset in days:
+            ChallengeAttempt.objects.create(user=user, challenge=self.challenge, date=self.today - datetime.timedelta(days=offset), attempts=1, correct=correct)
+
+    def test_normalize_answer(self):
+        #Test case, accents, punctuation and spaces are ignored.
+        self.assertEqual(normalize_answer('  FOTOSSÍNTESE!  '), 'fotossintese')
+        self.assertEqual(normalize_answer('Árvores   de\tfruto'), 'arvores de fruto')
+
+    def test_normalized_answers_are_stored(self):
+        #Test the answer and its synonyms are normalized when the challenge is saved.
+        self.assertEqual(self.challenge.normalized_answers, ['fotossintese', 'fotossintese clorofilina', 'foto sintese'])
+        self.assertTrue(is_correct(self.challenge, 'foto síntese'))
+        self.assertFalse(is_correct(self.challenge, 'respiração'))
+
+    def test_bulk_created_challenge(self):
+        #Test challenges written without signals are still graded.
+        Challenge.objects.bulk_create([Challenge(text='Cor das folhas?', correct_answer='Verde')])
+        self.assertTrue(is_correct(Challenge.objects.get(text='Cor das folhas?'), ' verde'))
+
+    def test_answer_is_graded_on_the_server(self):
+        #Test the page never holds the correct answer and a POST grades the answer.
+        response = self.client.get(reverse('challenge'))
+        self.assertNotContains(response, 'Fotossíntese')
+        self.assertNotContains(response, 'data-correct-answer')
+
+        self.assertRedirects(self.answer('respiração'), reverse('challenge'))
+        self.assertContains(self.client.get(reverse('challenge')), 'Resposta errada')
+        self.answer('fotossintese')
+        response = self.client.get(reverse('challenge'))
+        self.assertContains(response, 'Resposta correta')
+        self.assertNotContains(response, 'challenge-form')
+
+        attempt = ChallengeAttempt.objects.get(user=self.user, date=self.today)
+        self.assertEqual((attempt.attempts, attempt.correct), (2, True))
+
+    def test_answers_after_the_right_one_dont_count(self):
+        #Test a solved day keeps its attempt count.
+        grade_answer(self.user, self.challenge, 'Fotossíntese', self.today)
+        attempt = grade_answer(self.user, self.challenge, 'errado', self.today)
+        self.assertEqual((attempt.attempts, attempt.correct), (1, True))
+        self.assertEqual(ChallengeAttempt.objects.count(), 1)
+
+    def test_streak(self):
+        #Test the streak counts days in a row up to today or yesterday.
+        self.assertEqual(current_streak(self.user, self.today), 0)
+        self.add_days(self.user, [1, 2, 3, 5])
+        self.assertEqual(current_streak(self.user, self.today), 3)
+        grade_answer(self.user, self.challenge, 'fotossintese', self.today)
+        self.assertEqual(current_streak(self.user, self.today), 4)
+        self.assertEqual(current_streak(self.user, self.today + datetime.timedelta(days=2)), 0)
+
+    def test_wrong_days_break_the_streak(self):
+        #Test a day answered wrong isn't part of the streak.
+        self.add_days(self.user, [1, 3])
+        self.add_days(self.user, [2], correct=False)
+        self.assertEqual(current_streak(self.user, self.today), 1)
+
+    def test_leaderboards(self):
+        #Test the day ranks by attempts and the week by days solved.
+        other = User.objects.create(username='outro')
+        wednesday = datetime.date(2024, 5, 15)
+        grade_answer(other, self.challenge, 'errado', wednesday)
+        grade_answer(other, self.challenge, 'fotossintese', wednesday)
+        grade_answer(self.user, self.challenge, 'fotossintese', wednesday)
+        self.assertEqual([e.user for e in leaderboard('day', wednesday)], [self.user, other])
+
+        # Monday of the same week
+        grade_answer(other, self.challenge, 'fotossintese', wednesday - datetime.timedelta(days=2))
+        ranking = leaderboard('week', wednesday)
+        self.assertEqual([(e.user.username, e.solved) for e in ranking], [('outro', 2), ('testuser', 1)])
+
+    def test_quickest_breaks_ties(self):
+        #Test the day's users with the same attempts are ranked by who answered first.
+        quick = User.objects.create(username='rapido')
+        wednesday = datetime.date(2024, 5, 15)
+        grade_answer(quick, self.challenge, 'fotossintese', wednesday)
+        grade_answer(self.user, self.challenge, 'fotossintese', wednesday)
+        self.assertEqual([e.user for e in leaderboard('day', wednesday)], [quick, self.user])
+
+
+class LeaderboardTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'jogador{i}') for i in range(6)]
+        # A Wednesday, so the days before it fall in the same week
+        self.day = datetime.date(2024, 5, 15)
+        self.challenge = Challenge.objects.create(text='Cor das folhas?', correct_answer='Verde', date=self.day)
+
+    def play(self, days=20):
+        rng = random.Random(7)
+        for offset in range(days):
+            day = self.day - datetime.timedelta(days=offset)
+            for user in self.users:
+                for _ in range(rng.randint(0, 3)):
+                    grade_answer(user, self.challenge, rng.choice(['verde', 'azul']), day)
+
+    def boards(self):
+        return sorted(LeaderboardEntry.objects.values_list('period', 'period_start', 'user', 'solved', 'attempts', 'solved_at'))
+
+    def test_boards_follow_attempts(self):
+        #Test the incremental boards match the solved attempts.
+        self.play()
+        solved = ChallengeAttempt.objects.filter(correct=True)
+        for user in self.users:
+            entry = LeaderboardEntry.objects.filter(period='all', user=user).first()
+            days = solved.filter(user=user)
+            self.assertEqual((entry.solved, entry.attempts) if entry else (0, 0), (days.count(), sum(a.attempts for a in days)))
+
+    def test_rebuild_matches_incremental(self):
+        #Test a rebuild in small chunks gives the same boards as the incremental updates.
+        self.play()
+        incremental = self.boards()
+        out = StringIO()
+        call_command('rebuild_leaderboards', batch_size=7, stdout=out)
+        self.assertEqual(self.boards(), incremental)
+        self.assertIn(str(len(incremental)), out.getvalue())
+
+    def test_rebuild_with_concurrent_answer(self):
+        #Test an entry created between a board's delete and its insert doesn't make the rebuild fail.
+        self.play()
+        incremental = self.boards()
+        bulk_create = LeaderboardEntry.objects.bulk_create
+        answered = []
+
+        def answered_meanwhile(objs, **kwargs):
+            objs = list(objs)
+            if objs and not answered:
+                entry = objs[0]
+                add_to_entry(entry.period, entry.period_start, entry.user_id, 1, 1, timezone.now())
+                answered.append(entry)
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(LeaderboardEntry.objects, 'bulk_create', side_effect=answered_meanwhile):
+            rebuild_leaderboards(batch_size=7)
+        self.assertTrue(answered)
+        self.assertEqual(self.boards(), incremental)
+
+    def test_rebuild_drops_empty_boards(self):
+        #Test a rebuild over existing boards removes the ones left without solved attempts.
+        self.play()
+        incremental = self.boards()
+        day = self.day - datetime.timedelta(days=60)
+        add_to_entry('day', day, self.users[0].pk, 1, 1, timezone.now())
+        add_to_entry('week', period_start('week', day), self.users[0].pk, 1, 1, timezone.now())
+        rebuild_leaderboards(batch_size=7)
+        self.assertEqual(self.boards(), incremental)
+
+    def test_failed_rebuild_keeps_boards(self):
+        #Test a board whose rewrite fails keeps its old entries.
+        self.play()
+        incremental = self.boards()
+        with mock.patch.object(LeaderboardEntry.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                rebuild_leaderboards()
+        self.assertEqual(self.boards(), incremental)
+
+    def test_top_k(self):
+        #Test the board is ranked by days solved, then fewest attempts, and cut at the limit.
+        self.play()
+        for period in ('day', 'week', 'all'):
+            ranking = leaderboard(period, self.day, limit=3)
+            self.assertLessEqual(len(ranking), 3)
+            keys = [(-e.solved, e.attempts, e.solved_at, e.user_id) for e in ranking]
+            self.assertEqual(keys, sorted(keys))
+            self.assertTrue(all(e.period_start == period_start(period, self.day) for e in ranking))
+
+    def test_week_starts_on_monday(self):
+        #Test days of the same week share a board and the next Monday starts a new one.
+        self.assertEqual(period_start('week', self.day), datetime.date(2024, 5, 13))
+        self.assertEqual(period_start('week', datetime.date(2024, 5, 19)), datetime.date(2024, 5, 13))
+        self.assertEqual(period_start('week', datetime.date(2024, 5, 20)), datetime.date(2024, 5, 20))
+
+    def test_challenge_page_reads_the_boards(self):
+        #Test the challenge page shows the materialized boards.
+        cache.clear()
+        self.client.force_login(self.users[0])
+        today = timezone.localdate()
+        Challenge.objects.create(text='Hoje', correct_answer='Sol', date=today)
+        self.client.post(reverse('challenge'), {'user_answer': 'sol'})
+        response = self.client.get(reverse('challenge'))
+        self.assertEqual([e.user for e in response.context['daily_leaderboard']], [self.users[0]])
+        self.assertEqual([e.user for e in response.context['weekly_leaderboard']], [self.users[0]])
+
+
+class TestCacheTestCase(TestCase):
+    def test_tests_use_memory_cache(self):
+        #Test the test runner puts the shared cache in memory, whatever CACHE says.
+        self.assertEqual(settings.CACHES['shared']['BACKEND'], 'django.core.cache.backends.locmem.LocMemCache')
+        self.assertEqual(type(caches['shared']).__name__, 'LocMemCache')
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'tiered-test': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tiered-test'},
+})
+class TieredCacheTestCase(TestCase):
+    def setUp(self):
+        self.cache = TieredCache('tiered-test', {'OPTIONS': {'MAX_ENTRIES': 2, 'LOCAL_TIMEOUT': 60, 'LOCK_TIMEOUT': 2}})
+        self.cache.clear()
+        self.shared = caches['tiered-test']
+        self.before = self.cache.stats()
+
+    def counted(self, name):
+        return self.cache.stats()[name] - self.before[name]
+
+    def test_reads_come_from_the_process(self):
+        #Test a value is served from the process after its first read, and deletes reach both tiers.
+        self.shared.set('key', 'shared')
+        self.assertEqual(self.cache.get('key'), 'shared')
+        self.shared.set('key', 'changed')
+        self.assertEqual(self.cache.get('key'), 'shared')
+        self.assertEqual((self.counted('shared_hits'), self.counted('local_hits')), (1, 1))
+
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.assertIsNone(self.shared.get('key'))
+        self.assertEqual(self.counted('misses'), 1)
+
+    def test_new_shared_cache_gets_new_store(self):
+        #Test overriding the shared cache's settings doesn't serve the process copies of the old one.
+        def tiered(location):
+            return override_settings(CACHES={
+                'default': {'BACKEND': 'website.caching.TieredCache', 'LOCATION': 'tiered-test', 'OPTIONS': {'LOCAL_TIMEOUT': 60}},
+                'tiered-test': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': location},
+            })
+
+        with tiered('first'):
+            caches['default'].set('key', 'first')
+        with tiered('second'):
+            self.assertIsNone(caches['default'].get('key'))
+        with tiered('first'):
+            self.assertEqual(caches['default'].get('key'), 'first')
+
+    def test_local_copy_is_not_shared(self):
+        #Test changing a value read from the cache doesn't change the cached copy.
+        self.cache.set('key', {'a': 1})
+        self.cache.get('key')['a'] = 2
+        self.assertEqual(self.cache.get('key'), {'a': 1})
+        self.assertEqual(self.counted('local_hits'), 2)
+
+    def test_local_copies_expire(self):
+        #Test the process copy lives no longer than LOCAL_TIMEOUT or the entry's own timeout.
+        self.cache.set('key', 'value', 0.05)
+        self.shared.set('key', 'changed')
+        time.sleep(0.1)
+        self.assertEqual(self.cache.get('key'), 'changed')
+
+    def test_least_recently_used_is_evicted(self):
+        #Test the process keeps MAX_ENTRIES entries and drops the least recently read one.
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.shared.clear()
+        self.assertEqual((self.cache.get('a'), self.cache.get('b'), self.cache.get('c')), (1, None, 3))
+        self.assertEqual(self.counted('evictions'), 1)
+        self.assertEqual(self.cache.stats()['local_entries'], 2)
+
+    def test_get_or_set_recomputes_once(self):
+        #Test concurrent misses of the same key compute the value once.
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get_or_set('key', compute))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((self.counted('recomputes'), self.counted('waits')), (1, 4))
+
+    def test_get_or_set_waits_for_other_worker(self):
+        #Test a worker doesn't recompute a key another worker is already computing.
+        self.shared.add('key:recompute', 1)
+        timer = threading.Timer(0.1, lambda: self.shared.set('key', 'from other worker'))
+        timer.start()
+        self.assertEqual(self.cache.get_or_set('key', lambda: 'computed here'), 'from other worker')
+        timer.join()
+        self.assertEqual(self.counted('recomputes'), 0)
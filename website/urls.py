@@ -10,7 +10,9 @@ urlpatterns = [
     path('cart/', views.cart, name='cart'),
     path('checkout/', views.checkout, name='checkout'),
     path('update_item/', views.updateItem, name="update_item"),
+    path('cart_api/', views.cartApi, name="cart_api"),
     path('process_order/', views.processOrder, name="process_order"),
+    path('search/', views.search, name='search'),
     path('forum/', views.forum, name='forum'),
     path('question/<int:id>', views.question, name='question'),
     path('challenge/', views.challenge, name='challenge'),
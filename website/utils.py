@@ -1,51 +1,83 @@
+import hashlib
 import json
+from django.core.cache import cache
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Sum
 from .models import *
+from .catalogue import catalogue_version
 
 
+CART_SUMMARY_TIMEOUT = 5 * 60
 
 
-def cookieCart(request):
+
+
+# Read the cart cookie as {product_id: quantity}, dropping malformed entries
+def parseCookieCart(request):
     try:
-        cart = json.loads(request.COOKIES['cart'])
-    except:
-        cart = {}
+        cart = json.loads(request.COOKIES.get('cart', '{}'))
+    except ValueError:
+        return {}
+
+    if not isinstance(cart, dict):
+        return {}
+
+    parsed = {}
+    for key, entry in cart.items():
+        try:
+            product_id = int(key)
+            quantity = int(entry['quantity'])
+        except (TypeError, ValueError, KeyError):
+            continue
+        if quantity > 0:
+            parsed[product_id] = quantity
+    return parsed
+
 
-    print('Cart:', cart)
+def cookieCart(request):
+    return buildCookieCart(parseCookieCart(request))
+
+
+# Cart data for a parsed cookie cart, in the same shape cartData returns
+def buildCookieCart(cart):
     items = []
     order = {'get_cart_total': 0, 'get_cart_items': 0}
-    cartItems = order['get_cart_items']
 
-    for i in cart: 
-        try:
-            cartItems += cart[i]['quantity']
-
-            product = Product.objects.get(id=i)
-            total = (product.price * cart[i]['quantity'])
-
-            order['get_cart_total'] += total
-            order['get_cart_items'] += cart[i]['quantity']
-
-            item = {
-                'product': {
-                    'id': product.id,
-                    'name': product.name,
-                    'price': product.price,
-                    'image': product.image,
-                    },
-                'quantity': cart[i]['quantity'],
-                'get_total': total,
-            }
-            items.append(item)
-        except:
-            pass
-    return {'cartItems': cartItems, 'order': order, 'items': items}
+    # Resolve every product in the cookie with a single query
+    products = Product.objects.in_bulk(list(cart))
+
+    for product_id, quantity in cart.items():
+        product = products.get(product_id)
+        if product is None:
+            # Product was removed from the store since it was added to the cart
+            continue
+
+        total = (product.price * quantity)
+
+        order['get_cart_total'] += total
+        order['get_cart_items'] += quantity
+
+        item = {
+            'product': {
+                'id': product.id,
+                'name': product.name,
+                'price': product.price,
+                'image': product.image,
+                },
+            'quantity': quantity,
+            'get_total': total,
+        }
+        items.append(item)
+    return {'cartItems': order['get_cart_items'], 'order': order, 'items': items}
 
 
 def cartData(request):
     if request.user.is_authenticated:
-        customer = request.user.customer
-        order, created = Order.objects.get_or_create(customer=customer, complete=False)
-        items = order.orderitem_set.all()
+        # Read only, the open order is created by the first product added to it
+        order = Order.objects.filter(customer__user=request.user, complete=False).first()
+        if order is None:
+            return {'cartItems': 0, 'order': {'get_cart_total': 0, 'get_cart_items': 0}, 'items': []}
+        items = order.get_cart_lines
         cartItems = order.get_cart_items
     else:
         cookieData = cookieCart(request)
@@ -55,33 +87,184 @@ def cartData(request):
 
     return {'cartItems': cartItems, 'order': order, 'items': items}
 
-def guestOrder(request, data):
-    print('User is not logged in')
 
-    print('COOKIES:', request.COOKIES)
+def cartSummaryKey(user_id):
+    return f'cart:user:{user_id}'
+
+
+# Item count and total of the cart, cached per user, or per cookie contents and catalogue version for guests.
+# The user's entry is deleted by every change to their order, the guest's changes key with the cookie.
+def cachedCartSummary(request):
+    if request.user.is_authenticated:
+        key = cartSummaryKey(request.user.pk)
+    else:
+        cookie = request.COOKIES.get('cart')
+        if not cookie:
+            return {'cartItems': 0, 'cartTotal': 0.0}
+        key = f'cart:cookie:{catalogue_version()}:{hashlib.md5(cookie.encode()).hexdigest()}'
+
+    summary = cache.get(key)
+    if summary is None:
+        if request.user.is_authenticated:
+            totals = OrderItem.objects.filter(order__customer__user=request.user, order__complete=False).aggregate(
+                total=Sum(F('product__price') * F('quantity'), output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+                items=Sum('quantity'),
+            )
+            summary = {'cartItems': totals['items'] or 0, 'cartTotal': float(totals['total'] or 0)}
+        else:
+            data = cookieCart(request)
+            summary = {'cartItems': data['cartItems'], 'cartTotal': float(data['order']['get_cart_total'])}
+        cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+# Drop the user's cached summary once the transaction changing their order commits
+def invalidateCartSummary(user_id):
+    if user_id is not None:
+        transaction.on_commit(lambda: cache.delete(cartSummaryKey(user_id)))
+
+# Move the guest's cookie cart into the user's open order when they log in or sign up.
+# Quantities of products already in the order are added together, all lines are written with one upsert.
+def mergeCookieCart(request, user):
+    items = cookieCart(request)['items']
+    if not items:
+        return 0
+
+    quantities = {item['product']['id']: item['quantity'] for item in items}
+    with transaction.atomic():
+        # Locked like updateOrderItem, so a click in another tab isn't lost between the read and the upsert
+        order, created = Order.objects.select_for_update().get_or_create(customer=user.customer, complete=False)
+        existing = {} if created else dict(
+            order.orderitem_set.filter(product_id__in=quantities).values_list('product_id', 'quantity')
+        )
+
+        # MySQL finds the conflicting row by itself and doesn't accept the unique fields
+        unique_fields = ['order', 'product'] if connections[OrderItem.objects.db].features.supports_update_conflicts_with_target else None
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=order, product_id=product_id, quantity=quantity + (existing.get(product_id) or 0))
+             for product_id, quantity in quantities.items()],
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=['quantity'],
+        )
+        invalidateCartSummary(user.pk)
+    return len(quantities)
+
+
+# Add or remove one unit of a product in a parsed cookie cart
+def updateCookieItem(cart, productId, action):
+    quantity = cart.get(productId, 0) + (1 if action == 'add' else -1)
+    if quantity > 0:
+        cart[productId] = quantity
+    else:
+        cart.pop(productId, None)
+    return cart
+
+
+# Line totals and cart totals as JSON-friendly values, for cart data from cartData or buildCookieCart
+def cartSummary(data):
+    lines = []
+    for item in data['items']:
+        if isinstance(item, dict):
+            lines.append({'productId': item['product']['id'], 'quantity': item['quantity'], 'lineTotal': float(item['get_total'])})
+        else:
+            lines.append({'productId': item.product.id, 'quantity': item.quantity, 'lineTotal': float(item.get_total)})
+
+    order = data['order']
+    total = order['get_cart_total'] if isinstance(order, dict) else order.get_cart_total
+    return {'cartItems': data['cartItems'], 'cartTotal': float(total), 'lines': lines}
+
+
+# Add or remove one unit of a product in the customer's open order.
+# The order row is locked so clicks from several tabs are applied one after the other.
+def updateOrderItem(customer, productId, action):
+    with transaction.atomic():
+        order, created = Order.objects.select_for_update().get_or_create(customer=customer, complete=False)
+        lines = OrderItem.objects.filter(order=order, product_id=productId)
+
+        if action == 'add':
+            if not lines.update(quantity=F('quantity') + 1):
+                product = Product.objects.get(id=productId)
+                try:
+                    with transaction.atomic():
+                        OrderItem.objects.create(order=order, product=product, quantity=1)
+                except IntegrityError:
+                    # The order didn't exist yet and locked nothing, a concurrent first add created the line
+                    lines.update(quantity=F('quantity') + 1)
+        elif action == 'remove':
+            lines.update(quantity=F('quantity') - 1)
+            lines.filter(quantity__lte=0).delete()
+
+        line = lines.values('quantity', 'product__price').first()
+        quantity = line['quantity'] if line else 0
+        invalidateCartSummary(customer.user_id)
+
+        return {
+            'productId': productId,
+            'quantity': quantity,
+            'lineTotal': float(line['product__price'] * quantity) if line else 0,
+            'cartItems': order.get_cart_items,
+            'cartTotal': order.get_cart_total,
+        }
+
+
+# Order confirmation sent to the queue, built from the objects the checkout already has in memory.
+# Without lines, they are read with their products in one query.
+def orderMessage(order, customer, address, lines=None):
+    if lines is None:
+        lines = order.get_cart_lines
+
+    return {
+        "order_id": order.id,
+        "customer_name": customer.name,
+        "customer_email": customer.email,
+        "order_date": order.order_date.strftime("%Y-%m-%d %H:%M:%S"),
+        "address": {
+            "street": address.street,
+            "city": address.city,
+            "postal_code": address.postal_code,
+        },
+        "order_items": [
+            {
+                "product_name": item.product.name,
+                "quantity": item.quantity,
+            }
+            for item in lines
+        ],
+    }
+
+
+# Customer, open order and lines of a guest checkout, built from the cart cookie in one transaction.
+# The lines come back with their products loaded, for the order total and message.
+def guestOrder(request, data):
     name = data['form']['name']
     email = data['form']['email']
 
-    cookieData = cookieCart(request)
-    items = cookieData['items']
+    cart = parseCookieCart(request)
 
-    customer, created = Customer.objects.get_or_create(
-        email=email,
-    )
-    customer.name = name
-    customer.save()
+    with transaction.atomic():
+        # Every product in the cookie in one query, products removed from the store are skipped
+        products = Product.objects.in_bulk(list(cart))
 
-    order = Order.objects.create(
-        customer=customer,
-        complete=False,
-    )
+        # Only guest customers are reused, never a registered user's, so a guest can't touch someone's cart or account.
+        # A guest customer whose last checkout was left unfinished keeps that order, the new one goes on a new customer.
+        customer = Customer.objects.filter(email=email, user=None).exclude(order__complete=False).order_by('id').first()
+        if customer is None:
+            customer = Customer(email=email)
+        customer.name = name
+        customer.save()
 
-    for item in items:
-        product = Product.objects.get(id=item['product']['id'])
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(customer=customer)
+        except IntegrityError:
+            # A checkout with the same email opened an order on this customer in the meantime
+            customer = Customer.objects.create(email=email, name=name)
+            order = Order.objects.create(customer=customer)
 
-        orderItem = OrderItem.objects.create(
-            product=product,
-            order=order,
-            quantity=item['quantity']
-        )
-    return customer, order
\ No newline at end of file
+        lines = OrderItem.objects.bulk_create([
+            OrderItem(product=products[product_id], order=order, quantity=quantity)
+            for product_id, quantity in cart.items()
+            if product_id in products
+        ])
+    return customer, order, lines
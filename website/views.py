@@ -1,20 +1,36 @@
-from random import choice
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from django.views.decorators.csrf import ensure_csrf_cookie
 from django.http import JsonResponse
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils import timezone
+from django.core.paginator import Paginator
 from .models import *
 import json
 import datetime
 from .forms import SignUpForm, QuestionForm, AnswerForm, ChallengeAnswerForm
-from .utils import cartData, guestOrder
-import asyncio
-from .sendmessage import send_single_message
+from .utils import cartData, cartSummary, cachedCartSummary, invalidateCartSummary, guestOrder, orderMessage, mergeCookieCart, updateOrderItem, updateCookieItem, parseCookieCart, buildCookieCart
+from .forum import forum_page, render_answers
+from .catalogue import catalogue_query, catalogue_version, catalogue_etag, render_catalogue, parse_int
+from .challenges import daily_challenge, grade_answer, current_streak
+from .leaderboards import leaderboard
+from .search import SearchResults, SEARCH_KINDS, SEARCH_PAGE_SIZE
 
 def home(request):
     return render(request, 'home.html')
 
+# Bring the guest cart along after logging in, then drop the cookie so later requests don't read it again
+def loggedIn(request, user):
+    mergeCookieCart(request, user)
+    response = redirect('home')
+    if 'cart' in request.COOKIES:
+        response.delete_cookie('cart')
+    return response
+
 def login_user(request):
     if request.method == 'POST':
         username = request.POST['username']
@@ -23,7 +39,7 @@ def login_user(request):
         user = authenticate(request, username=username, password=password)
         if user is not None:
             login(request, user)
-            return redirect('home')
+            return loggedIn(request, user)
         else:
             return redirect('login')
     else:
@@ -43,7 +59,7 @@ def signup_user(request):
 			password = form.cleaned_data['password1']
 			user = authenticate(request, username=username, password=password)
 			login(request, user)
-			return redirect('home')
+			return loggedIn(request, user)
 	else:
 		form = SignUpForm()
 		return render(request, 'signup.html', {'form':form})
@@ -51,23 +67,31 @@ def signup_user(request):
 	return render(request, 'signup.html', {'form':form})
 
 
+@ensure_csrf_cookie
 def store(request):
 
-    data = cartData(request)
-    cartItems = data['cartItems']
-
-    category_id = request.GET.get('category')
-    products = Product.objects.all()
+    cartItems = cachedCartSummary(request)['cartItems']
 
-    if category_id:
-        products = products.filter(category_id=category_id)
+    version = catalogue_version()
+    query = catalogue_query(request, version)
 
-    categories = Category.objects.all()
+    # Browsers can revalidate with If-None-Match. There's no Last-Modified: the catalogue version alone
+    # would answer 304 to If-Modified-Since after the cart badge changed.
+    etag = catalogue_etag(query, version, request.user, cartItems)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        catalogue = render_catalogue(query, version)
+        response = render(request, 'store.html', {'catalogue': catalogue, 'cartItems': cartItems})
 
-    return render(request, 'store.html', {'products' : products, 'cartItems': cartItems, 'categories': categories})
+    response['ETag'] = etag
+    # The page holds the user's cart, shared caches must not keep it
+    patch_cache_control(response, private=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
 
 
 
+@ensure_csrf_cookie
 def cart(request):
 
     data = cartData(request)
@@ -78,6 +102,7 @@ def cart(request):
     return render(request, 'cart.html', {'items': items, 'order': order, 'cartItems': cartItems})
 
 
+@ensure_csrf_cookie
 def checkout(request):
 
     data = cartData(request)
@@ -89,95 +114,146 @@ def checkout(request):
         
 
 
+# Product id and action of a cart update body, or the 400 response for a malformed one
+def parseCartUpdate(request):
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return None, None, JsonResponse({'error': 'Pedido inválido'}, status=400)
+    if not isinstance(data, dict):
+        return None, None, JsonResponse({'error': 'Pedido inválido'}, status=400)
+
+    try:
+        productId = int(data.get('productId'))
+    except (TypeError, ValueError):
+        return None, None, JsonResponse({'error': 'Produto inválido'}, status=400)
+
+    action = data.get('action')
+    if action not in ('add', 'remove'):
+        return None, None, JsonResponse({'error': 'Ação inválida'}, status=400)
+    return productId, action, None
+
+
 def updateItem(request):
-    data = json.loads(request.body)
-    productId = data['productId']
-    action = data['action']
+    # Guests keep their cart in the cookie, see cartApi
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Sessão necessária'}, status=401)
 
-    print('Action:', action)
-    print('productId:', productId)
+    productId, action, error = parseCartUpdate(request)
+    if error:
+        return error
 
     customer = request.user.customer
-    product = Product.objects.get(id=productId)
-    order, created = Order.objects.get_or_create(customer=customer, complete=False)
 
-    orderItem, created = OrderItem.objects.get_or_create(order=order, product=product)
+    try:
+        line = updateOrderItem(customer, productId, action)
+    except Product.DoesNotExist:
+        return JsonResponse({'error': 'Produto não encontrado'}, status=404)
+
+    return JsonResponse(line)
 
-    if action == 'add':
-        orderItem.quantity = (orderItem.quantity + 1)
-    elif action == 'remove':
-        orderItem.quantity = (orderItem.quantity -1)
 
-    orderItem.save()
+# GET returns the cart totals, POST adds or removes one unit of a product.
+# Works for both guest (cookie) and customer carts.
+def cartApi(request):
+    if request.method == 'GET':
+        return JsonResponse(cartSummary(cartData(request)))
 
-    if orderItem.quantity <= 0:
-        orderItem.delete()
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método não permitido'}, status=405)
 
-    return JsonResponse('Item was added', safe=False)
+    productId, action, error = parseCartUpdate(request)
+    if error:
+        return error
+
+    if request.user.is_authenticated:
+        try:
+            return JsonResponse(updateOrderItem(request.user.customer, productId, action))
+        except Product.DoesNotExist:
+            return JsonResponse({'error': 'Produto não encontrado'}, status=404)
+
+    cart = updateCookieItem(parseCookieCart(request), productId, action)
+    summary = cartSummary(buildCookieCart(cart))
+    lines = {line['productId']: line for line in summary['lines']}
+
+    if action == 'add' and productId not in lines:
+        return JsonResponse({'error': 'Produto não encontrado'}, status=404)
+
+    line = lines.get(productId, {'quantity': 0, 'lineTotal': 0})
+    return JsonResponse({
+        'productId': productId,
+        'quantity': line['quantity'],
+        'lineTotal': line['lineTotal'],
+        'cartItems': summary['cartItems'],
+        'cartTotal': summary['cartTotal'],
+        # The browser keeps the guest cart in its cookie, only products that still exist are kept
+        'cart': {str(key): {'quantity': value['quantity']} for key, value in lines.items()},
+    })
+
+
+# Checkout body with every field processOrder reads, or None when one is missing or malformed
+def parseCheckout(request):
+    required = {'form': ['total'], 'shipping': ['street', 'city', 'postal_code']}
+    if not request.user.is_authenticated:
+        required['form'] += ['name', 'email']
+
+    try:
+        data = json.loads(request.body)
+        float(data['form']['total'])
+        for section, fields in required.items():
+            for field in fields:
+                if not isinstance(data[section][field], (str, int, float)):
+                    return None
+    except (ValueError, TypeError, KeyError):
+        return None
+    return data
 
 
 def processOrder(request):
     transaction_id = datetime.datetime.now().timestamp()
-    data = json.loads(request.body)
+    data = parseCheckout(request)
+    if data is None:
+        return JsonResponse({'error': 'Pedido inválido'}, status=400)
+
+    # The order, its address and its outbox event are saved together or not at all
+    with transaction.atomic():
+        if request.user.is_authenticated:
+            customer = request.user.customer
+            order, created = Order.objects.get_or_create(customer=customer, complete=False)
+            lines = list(order.get_cart_lines)
+            invalidateCartSummary(request.user.pk)
 
-    if request.user.is_authenticated:
-        customer = request.user.customer
-        order, created = Order.objects.get_or_create(customer=customer, complete=False)
+        else:
+            customer, order, lines = guestOrder(request, data)
 
-    else:
-        customer, order = guestOrder(request, data)
-
-    Address.objects.create(
-            customer = customer,
-            order = order,
-            street = data['shipping']['street'],
-            city = data['shipping']['city'],
-            postal_code = data['shipping']['postal_code'],
-        )
-
-    total = float(data['form']['total'])
-    order.transaction_id = transaction_id
-
-    if total == order.get_cart_total:
-        order.complete = True
-    order.save()
-
-    # Serialize the order items into a list of dictionaries
-    order_items = [
-        {
-            "product_name": item.product.name,
-            "quantity": item.quantity,
-        }
-        for item in OrderItem.objects.filter(order=order)
-    ]
-
-    address = Address.objects.get(order=order)
-
-    # Construct the message content as a dictionary
-    message_content = {
-        "order_id": order.id,
-        "customer_name": order.customer.name,
-        "customer_email": order.customer.email,
-        "order_date": order.order_date.strftime("%Y-%m-%d %H:%M:%S"),
-        "address": {
-            "street": address.street,
-            "city": address.city,
-            "postal_code": address.postal_code,
-        },
-        "order_items": order_items,
-    }
+        address = Address.objects.create(
+                customer = customer,
+                order = order,
+                street = data['shipping']['street'],
+                city = data['shipping']['city'],
+                postal_code = data['shipping']['postal_code'],
+            )
 
-    # Serialize the message content to JSON
-    order_json = json.dumps(message_content)
+        total = float(data['form']['total'])
+        order.transaction_id = transaction_id
 
-    asyncio.run(send_single_message(order_json))
+        # The lines are already loaded with their products, total them here instead of another query
+        if total == float(sum(item.get_total for item in lines)):
+            order.complete = True
+        order.save()
 
+        if order.complete:
+            message_content = orderMessage(order, customer, address, lines)
+
+            # Sent to the queue later by the drain_outbox command, the checkout doesn't wait for the broker
+            OrderEvent.objects.create(order=order, payload=json.dumps(message_content))
 
     return JsonResponse('Payment complete', safe=False)
 
 @login_required
 def forum(request):
-    questions = Question.objects.all()
+    sort = request.GET.get('sort', 'recent')
+    questions, next_cursor = forum_page(request.GET.get('cursor'), sort=sort)
 
     if request.method == 'POST':
         form = QuestionForm(request.POST, request.FILES)
@@ -189,12 +265,26 @@ def forum(request):
     else:
         form = QuestionForm()
     
-    return render(request, 'forum.html', {'questions': questions, 'form': form})
+    return render(request, 'forum.html', {'questions': questions, 'next_cursor': next_cursor, 'sort': sort, 'form': form})
+
+# Ranked search over the products or the forum questions
+def search(request):
+    query = request.GET.get('q', '').strip()
+    kind = request.GET.get('type')
+    if kind not in SEARCH_KINDS:
+        kind = 'products'
+    # The forum is only for logged in users, like the forum and question pages
+    if kind == 'questions' and not request.user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    page = Paginator(SearchResults(kind, query), SEARCH_PAGE_SIZE).get_page(parse_int(request.GET.get('page'), 1))
+
+    context = {'query': query, 'kind': kind, 'page': page, 'results': page.object_list}
+    return render(request, 'search.html', context)
 
 @login_required
 def question(request, id):
-    question = Question.objects.get(pk=id)
-    answers = Answer.objects.filter(question=question)
+    question = get_object_or_404(Question.objects.select_related('user'), pk=id)
 
     if request.method == 'POST':
         form = AnswerForm(request.POST)
@@ -207,29 +297,33 @@ def question(request, id):
     else:
         form = AnswerForm()
 
+    answers = render_answers(question.id, request.GET.get('cursor'))
     return render(request, 'question.html', {'question': question, 'answers': answers, 'form': form})
 
 @login_required
 def challenge(request):
-    current_date = datetime.date.today()
-    print("Current Date:", current_date)
-
-    # Get challenges with the current date
-    challenges = Challenge.objects.filter(date=current_date)
-    print("Challenges for Today:", challenges)
-
-    if challenges:
-        # Choose a random challenge from the list
-        selected_challenge = choice(challenges)
-        print("Selected Challenge:", selected_challenge)
-        # Store the selected challenge's ID in the session
-        request.session['selected_challenge_id'] = selected_challenge.id
-    else:
-        selected_challenge = None
+    selected_challenge = daily_challenge()
+    today = timezone.localdate()
 
-    if request.method == 'POST':
+    if request.method == 'POST' and selected_challenge is not None:
         form = ChallengeAnswerForm(request.POST)
+        if form.is_valid():
+            # Graded here, the right answer never reaches the page
+            grade_answer(request.user, selected_challenge, form.cleaned_data['user_answer'], today)
+            return redirect('challenge')
     else:
         form = ChallengeAnswerForm()
 
-    return render(request, 'challenge.html', {'challenge': selected_challenge, 'form': form})
+    attempt = None
+    if selected_challenge is not None:
+        attempt = ChallengeAttempt.objects.filter(user=request.user, date=today).first()
+
+    context = {
+        'challenge': selected_challenge,
+        'form': form,
+        'attempt': attempt,
+        'streak': current_streak(request.user, today),
+        'daily_leaderboard': leaderboard('day', today),
+        'weekly_leaderboard': leaderboard('week', today),
+    }
+    return render(request, 'challenge.html', context)